@@ -0,0 +1,283 @@
+"""
+Time the loading, extraction and search paths against a synthetic catalog
+of recipes, stored in a temporary database.
+
+    python benchmark.py --recipes 5000 --save baseline.json
+    python benchmark.py --recipes 5000 --compare baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import db
+from definitions import Ingredient
+from processing import IngrIndex, IngrParser, Loader, Searcher
+
+SYLLABLES = ('ba', 'ca', 'ci', 'co', 'da', 'fa', 'fi', 'ga', 'gno', 'la',
+             'le', 'li', 'lo', 'ma', 'me', 'mo', 'na', 'ne', 'pa', 'pe',
+             'pi', 'po', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'so', 'ta',
+             'te', 'ti', 'to', 'va', 've', 'vi', 'za', 'zu')
+ENDINGS = ('a', 'e', 'i', 'o')
+QUANTITIES = ('100 g di {}', '2 cucchiai di {}', '1 pizzico di {}',
+              '300 ml di {}', 'un ciuffo di {}', '{} q.b.', '3 {} grandi',
+              '{}')
+# Words of QUANTITIES, never used as ingredient names.
+FILLER_WORDS = {'g', 'di', 'cucchiai', 'pizzico', 'ml', 'un', 'ciuffo', 'q',
+                'b', 'grandi'}
+
+# Relative change of a metric reported as a regression when comparing.
+DEFAULT_TOLERANCE = 0.1
+
+
+def _word(rng: random.Random) -> str:
+    syllables = rng.choices(SYLLABLES, k=rng.randint(2, 4))
+    return ''.join(syllables) + rng.choice(ENDINGS)
+
+
+def _names(rng: random.Random, count: int, taken_stems: set) -> list[str]:
+    """Return count ingredient names whose stems aren't in taken_stems."""
+    names = []
+    while len(names) < count:
+        words = [_word(rng) for _ in range(rng.choice((1, 1, 1, 2)))]
+        name = ' '.join(words)
+        ingr_stem = Ingredient(name).stem
+        if ingr_stem in taken_stems or FILLER_WORDS.intersection(words):
+            continue
+        taken_stems.add(ingr_stem)
+        names.append(name)
+    return names
+
+
+def generate_catalog(directory: str,
+                     num_recipes: int = 2000,
+                     ingredients_per_recipe: int = 8,
+                     vocabulary_size: int = 500,
+                     unknown_rate: float = 0.05,
+                     seed: int = 0) -> tuple[str, str, list[str]]:
+    """
+    Write an ingredients file and a recipes CSV into directory. Return
+    their paths and the names of the ingredients missing from the
+    ingredients file, which a fraction unknown_rate of the recipe lines
+    contain.
+    The same arguments always produce the same files.
+    """
+    rng = random.Random(seed)
+    taken_stems = set()
+    vocabulary = _names(rng, vocabulary_size, taken_stems)
+    unknowns = _names(rng, max(1, vocabulary_size // 10), taken_stems)
+
+    ingredients_path = os.path.join(directory, 'ingredients.txt')
+    with open(ingredients_path, 'w') as fp:
+        fp.writelines(name + '\n' for name in vocabulary)
+
+    recipes_path = os.path.join(directory, 'recipes.csv')
+    with open(recipes_path, 'w') as fp:
+        for recipe_num in range(num_recipes):
+            title = f'{_word(rng).capitalize()} {recipe_num}'
+            url = f'https://example.com/ricetta/{recipe_num}/'
+            lines = []
+            for name in rng.sample(vocabulary, ingredients_per_recipe):
+                if rng.random() < unknown_rate:
+                    name = rng.choice(unknowns)
+                lines.append(rng.choice(QUANTITIES).format(name))
+            fp.write(','.join([title, url, *lines]) + '\n')
+
+    return ingredients_path, recipes_path, unknowns
+
+
+def _percentiles(samples: list[float]) -> dict:
+    """Return p50, p90 and p99 of samples, in milliseconds."""
+    if len(samples) < 2:
+        samples = samples * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {f'p{p}_ms': cuts[p - 1] * 1000 for p in (50, 90, 99)}
+
+
+@contextmanager
+def _stage(results: dict, name: str, trace_memory: bool):
+    """Time the block, and trace its peak memory if trace_memory."""
+    result = results[name] = {}
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+        if trace_memory:
+            result['peak_memory_kib'] = \
+                tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        logging.info(f'{name}: {result}')
+
+
+def _latencies(func, calls) -> list[float]:
+    samples = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run(num_recipes: int = 2000,
+        ingredients_per_recipe: int = 8,
+        vocabulary_size: int = 500,
+        unknown_rate: float = 0.05,
+        seed: int = 0,
+        num_queries: int = 200,
+        workers: int = 1,
+        trace_memory: bool = False) -> dict:
+    """
+    Generate a catalog and time each stage against a fresh temporary
+    database. Return {stage: {metric: value}}.
+    """
+    results = {}
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        ingredients_path, recipes_path, unknown_names = generate_catalog(
+            directory, num_recipes, ingredients_per_recipe, vocabulary_size,
+            unknown_rate, seed)
+        interface = db.Interface(os.path.join(directory, 'recipes.db'))
+        loader = Loader(interface)
+        loader.set_ingr_path(ingredients_path)
+        loader.set_recipes_path(recipes_path)
+        searcher = Searcher(interface)
+
+        with _stage(results, 'store_ingredients', trace_memory) as result:
+            loader.store_ingredients()
+        result['ingredients_per_second'] = \
+            vocabulary_size / result['seconds']
+
+        with _stage(results, 'load_recipes', trace_memory) as result:
+            loader.load_recipes(workers=workers, incremental=False)
+        result['recipes_per_second'] = num_recipes / result['seconds']
+
+        ingredients = list(interface.get_ingredients())
+        rows = list(loader._read_recipe_line(recipes_path))
+        lines = [line
+                 for row in rng.sample(rows, min(num_queries, len(rows)))
+                 for line in row[2:]]
+
+        parser = IngrParser()
+        ingr_index = IngrIndex(ingredients)
+
+        def extract(line):
+            try:
+                parser.extract_ingredient(line, ingr_index)
+            except ValueError:
+                pass
+
+        with _stage(results, 'extract_ingredient', trace_memory) as result:
+            samples = _latencies(extract, ((line,) for line in lines))
+        result.update(_percentiles(samples))
+        result['lines_per_second'] = len(lines) / result['seconds']
+
+        queries = [rng.sample(ingredients, rng.randint(1, 2))
+                   for _ in range(num_queries)]
+        with _stage(results, 'interface_get_recipes', trace_memory) as result:
+            samples = _latencies(interface.get_recipes,
+                                 ((query,) for query in queries))
+        result.update(_percentiles(samples))
+
+        names = [[ingr.name for ingr in query] for query in queries]
+        # The first search builds the index, timed on its own.
+        with _stage(results, 'searcher_index', trace_memory):
+            searcher.recipe_index
+        with _stage(results, 'searcher_get_recipes', trace_memory) as result:
+            samples = _latencies(searcher.get_recipes,
+                                 ((query,) for query in names))
+        result.update(_percentiles(samples))
+
+        unknowns = [Ingredient(rng.choice(unknown_names))
+                    for _ in range(num_queries)]
+        # The first lookup builds the index, timed on its own.
+        with _stage(results, 'unknown_index', trace_memory):
+            loader.unknown_index
+        with _stage(results, 'get_solution_candidates',
+                    trace_memory) as result:
+            samples = _latencies(loader.get_solution_candidates,
+                                 ((ingr,) for ingr in unknowns))
+        result.update(_percentiles(samples))
+
+        interface.close()
+    return results
+
+
+def compare(baseline: dict, results: dict,
+            tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Print each metric of results next to its baseline value, and return
+    the metrics that got worse by more than tolerance.
+    """
+    regressions = []
+    for stage, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(stage, {}).get(metric)
+            if not base:
+                continue
+            change = value / base - 1
+            # Rates are better when higher, everything else when lower.
+            worse = -change if metric.endswith('_per_second') else change
+            flag = ''
+            if worse > tolerance:
+                flag = '  REGRESSION'
+                regressions.append(f'{stage}.{metric}')
+            print(f'{stage:26} {metric:24} {base:12.3f} {value:12.3f} '
+                  f'{change:+8.1%}{flag}')
+    return regressions
+
+
+def main(argv: list[str] = None):
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--recipes', type=int, default=2000)
+    arg_parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+    arg_parser.add_argument('--vocabulary', type=int, default=500)
+    arg_parser.add_argument('--unknown-rate', type=float, default=0.05)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--queries', type=int, default=200)
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--memory', action='store_true',
+                            help='trace peak memory, slowing stages down')
+    arg_parser.add_argument('--save', metavar='PATH',
+                            help='write results as JSON')
+    arg_parser.add_argument('--compare', metavar='PATH',
+                            help='compare with results saved before')
+    arg_parser.add_argument('--tolerance', type=float,
+                            default=DEFAULT_TOLERANCE)
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.recipes, args.ingredients_per_recipe, args.vocabulary,
+                  args.unknown_rate, args.seed, args.queries, args.workers,
+                  args.memory)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({'arguments': vars(args), 'results': results}, fp,
+                      indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            return 1
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -1,10 +1,48 @@
+import functools
+import itertools
 import logging
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
 
-from definitions import Ingredient, Recipe
+import instrumentation
+from definitions import Ingredient, Recipe, stem
 from paths import database_path
 
 _ILLEGAL_SQL_CHARS = ';'
+# Maximum number of values bound in a single "IN (...)" list.
+_MAX_SQL_PARAMS = 500
+# Number of compiled statements each connection keeps for reuse.
+STATEMENT_CACHE_SIZE = 256
+# Number of rows fetched at a time when iterating over query results.
+FETCH_BATCH_SIZE = 1000
+# Number of read-only connections an Interface opens besides the one it
+# writes with.
+NUM_READERS = 4
+# Number of past generations whose changed recipes are logged, see
+# Interface.get_recipe_changes.
+RECIPE_CHANGES_KEPT = 10000
+
+# Set on every connection.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # Negative sizes are in KiB.
+    'cache_size': -16384,
+    'mmap_size': 2 ** 28,
+    'foreign_keys': 'ON',
+}
+
+
+def _is_legal_sql(query: str):
+    for c in _ILLEGAL_SQL_CHARS:
+        if c in query:
+            return False
+    return True
+
 
 def _create_table_query(*, name: str, fields: dict, constraints=()):
     header = f'CREATE TABLE IF NOT EXISTS {name}\n'
@@ -27,287 +65,1121 @@ def _create_table_query(*, name: str, fields: dict, constraints=()):
     return base_query
 
 
+def _add_stem_column(table: str, name_column: str, executer):
+    """
+    Store the stems of the names in name_column in a new ingr_stem column of
+    table, computing them for the rows already present.
+    """
+    columns = executer.execute_query(f'PRAGMA table_info({table})')
+    if 'ingr_stem' in (name for _, name, *_ in columns):
+        return
+    executer.create_function('stem', 1, stem)
+    executer.execute_query(f'ALTER TABLE {table} ADD COLUMN ingr_stem text')
+    executer.execute_query(
+        f'UPDATE {table} SET ingr_stem = stem({name_column})')
+
+
+def _recipe_change_trigger(table: str, event: str) -> str:
+    """
+    Return statement creating a trigger that logs the recipe of rows of
+    table affected by event in recipe_changes, under the generation the
+    change will be committed with.
+    """
+    row = 'OLD' if event == 'DELETE' else 'NEW'
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_logged
+        AFTER {event} ON {table}
+        BEGIN
+            INSERT OR IGNORE INTO recipe_changes(generation, recipe_id)
+                SELECT generation + 1, {row}.recipe_id
+                FROM data_generation;
+        END
+        '''
+
+
+_TABLES = (
+    {
+        'name': 'recipes',
+        'fields': {
+            'recipe_id': 'integer primary key autoincrement',
+            'title': 'text unique',
+            'url': 'text unique',
+            # Both should be unique, not their combination.
+        }
+    },
+    {
+        'name': 'ingredients',
+        'fields': {
+            'name': 'text primary key',
+        }
+    },
+    {
+        'name': 'recipes_ingredients',
+        'fields': {
+            'recipe_id': 'integer',
+            'ingr_name': 'text',
+        },
+        'constraints': [
+            'primary key (recipe_id, ingr_name)',
+            'foreign key (recipe_id) references recipes(recipe_id)',
+            'foreign key (ingr_name) references ingredients(name)',
+        ]
+    },
+    {
+        'name': 'ingr_unknowns',
+        'fields': {
+            'recipe_id': 'integer',
+            'text_containing_ingr': 'text',
+        },
+        'constraints': (
+            'foreign key (recipe_id) references recipes(recipe_id)',
+        )
+    },
+)
+
+_LOADING_TABLES = (
+    {
+        # Hash of the file row each recipe was loaded from.
+        'name': 'recipe_rows',
+        'fields': {
+            'recipe_id': 'integer primary key',
+            'row_hash': 'text',
+        },
+        'constraints': (
+            'foreign key (recipe_id) references recipes(recipe_id)',
+        )
+    },
+    {
+        # State of each recipes file at the end of its last load.
+        'name': 'loaded_files',
+        'fields': {
+            'path': 'text primary key',
+            'mtime_ns': 'integer',
+            'size': 'integer',
+            'digest': 'text',
+        },
+    },
+)
+
+# Each migration brings the schema from the previous version to the next. It
+# is a list of SQL statements, or of functions taking the _SqlExecuter. The
+# version of a database is the number of migrations applied to it, stored as
+# its user_version.
+# Databases created before versioning have version 0 but may already have
+# any of these objects, so all steps must be idempotent.
+_MIGRATIONS = [
+    # 1: Recipes, ingredients, and texts pending review.
+    [_create_table_query(**table) for table in _TABLES],
+
+    # 2: Ingredient stems, to search recipes by ingredient in SQL.
+    [
+        functools.partial(_add_stem_column,
+                          'recipes_ingredients', 'ingr_name'),
+        '''
+        CREATE INDEX IF NOT EXISTS recipes_ingredients_by_stem
+        ON recipes_ingredients(ingr_stem, recipe_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS ingr_unknowns_by_recipe
+        ON ingr_unknowns(recipe_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS recipes_by_title
+        ON recipes(title COLLATE NOCASE)
+        ''',
+    ],
+
+    # 3: Incremental loading of recipe files.
+    [_create_table_query(**table) for table in _LOADING_TABLES],
+
+    # 4: Number of unknowns per recipe and in total, kept up to date by
+    # triggers so they can be read without scanning ingr_unknowns. Recipes
+    # without unknowns have no row in unknowns_per_recipe.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS unknowns_per_recipe
+        (recipe_id integer primary key,
+        num_unknowns integer not null)
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS unknowns_total
+        (id integer primary key check (id = 0),
+        num_unknowns integer not null)
+        ''',
+        '''
+        INSERT OR IGNORE INTO unknowns_per_recipe(recipe_id, num_unknowns)
+            SELECT recipe_id, count(*)
+            FROM ingr_unknowns
+            GROUP BY recipe_id
+        ''',
+        '''
+        INSERT OR IGNORE INTO unknowns_total(id, num_unknowns)
+            SELECT 0, count(*)
+            FROM ingr_unknowns
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS ingr_unknowns_inserted
+        AFTER INSERT ON ingr_unknowns
+        BEGIN
+            INSERT OR IGNORE INTO unknowns_per_recipe(recipe_id, num_unknowns)
+                VALUES (NEW.recipe_id, 0);
+            UPDATE unknowns_per_recipe
+                SET num_unknowns = num_unknowns + 1
+                WHERE recipe_id = NEW.recipe_id;
+            UPDATE unknowns_total
+                SET num_unknowns = num_unknowns + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS ingr_unknowns_deleted
+        AFTER DELETE ON ingr_unknowns
+        BEGIN
+            UPDATE unknowns_per_recipe
+                SET num_unknowns = num_unknowns - 1
+                WHERE recipe_id = OLD.recipe_id;
+            DELETE FROM unknowns_per_recipe
+                WHERE recipe_id = OLD.recipe_id AND num_unknowns <= 0;
+            UPDATE unknowns_total
+                SET num_unknowns = num_unknowns - 1;
+        END
+        ''',
+        # Replaces the view of earlier versions, which referenced a
+        # misspelled table.
+        'DROP VIEW IF EXISTS recipes_with_unknowns',
+        '''
+        CREATE VIEW recipes_with_unknowns
+        AS
+            SELECT recipe_id, title, num_unknowns AS num_unknown_ingr
+            FROM unknowns_per_recipe
+            JOIN recipes USING(recipe_id)
+        ''',
+    ],
+
+    # 5: Delete unknowns by text without scanning the table.
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS ingr_unknowns_by_text
+        ON ingr_unknowns(text_containing_ingr)
+        ''',
+    ],
+
+    # 6: Counter of changes to searchable data, see Interface.generation.
+    [
+        'CREATE TABLE data_generation (generation INTEGER NOT NULL)',
+        'INSERT INTO data_generation(generation) VALUES(0)',
+    ],
+
+    # 7: Stems of stored ingredients, so they aren't computed on import.
+    [
+        functools.partial(_add_stem_column, 'ingredients', 'name'),
+    ],
+
+    # 8: Recipes changed by each generation, so indexes can be kept in sync
+    # without reading every recipe. Ingredients and unknowns are only added
+    # to a recipe while it's inserted or updated, or when solving one of its
+    # unknowns, which deletes it: rows added to them aren't logged, as that
+    # would slow loading down.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS recipe_changes
+        (generation integer not null,
+        recipe_id integer not null,
+        primary key (generation, recipe_id))
+        WITHOUT ROWID
+        ''',
+        _recipe_change_trigger('recipes', 'INSERT'),
+        _recipe_change_trigger('recipes', 'UPDATE'),
+        _recipe_change_trigger('recipes', 'DELETE'),
+        _recipe_change_trigger('recipes_ingredients', 'DELETE'),
+        _recipe_change_trigger('ingr_unknowns', 'DELETE'),
+    ],
+]
+
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+# Statements run by Interface, by name. They are checked for illegal
+# characters once, here, instead of on every execution. A "{values}" field
+# stands for a list of as many "?" as values are passed.
+_STATEMENTS = {
+    'insert_recipe': '''
+        INSERT INTO recipes(title, url)
+        VALUES(?, ?)
+        ''',
+    'update_recipe': '''
+        UPDATE recipes
+        SET title = (?), url = (?)
+        WHERE recipe_id = (?)
+        ''',
+    'delete_recipe': '''
+        DELETE FROM recipes
+        WHERE recipe_id = (?)
+        ''',
+    'recipe_id': '''
+        SELECT recipe_id
+        FROM recipes
+        WHERE title = (?) COLLATE NOCASE
+            AND url = (?) COLLATE NOCASE
+        ''',
+    'recipe_id_by_title_or_url': '''
+        SELECT recipe_id
+        FROM recipes
+        WHERE title = (?) OR url = (?)
+        ''',
+    'recipes_without_unknowns': '''
+        SELECT r.recipe_id, r.title, r.url, ri.ingr_name
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        WHERE NOT EXISTS
+            (SELECT 1 FROM unknowns_per_recipe u
+            WHERE u.recipe_id = r.recipe_id)
+        ORDER BY r.recipe_id
+        ''',
+    # Recipes having as many distinct matching stems as requested contain
+    # all of them.
+    'recipes_without_unknowns_by_stems': '''
+        SELECT r.recipe_id, r.title, r.url, ri.ingr_name
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        WHERE NOT EXISTS
+            (SELECT 1 FROM unknowns_per_recipe u
+            WHERE u.recipe_id = r.recipe_id)
+        AND r.recipe_id IN
+            (SELECT recipe_id
+            FROM recipes_ingredients
+            WHERE ingr_stem IN ({values})
+            GROUP BY recipe_id
+            HAVING count(DISTINCT ingr_stem) = ?)
+        ORDER BY r.recipe_id
+        ''',
+    'recipes_by_id': '''
+        SELECT r.recipe_id, r.title, r.url, ri.ingr_name
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        WHERE r.recipe_id IN ({values})
+        ORDER BY r.recipe_id
+        ''',
+    'recipe_stems': '''
+        SELECT DISTINCT r.recipe_id, ri.ingr_stem
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        WHERE NOT EXISTS
+            (SELECT 1 FROM unknowns_per_recipe u
+            WHERE u.recipe_id = r.recipe_id)
+        ORDER BY r.recipe_id
+        ''',
+    'recipe_stems_by_id': '''
+        SELECT DISTINCT r.recipe_id, ri.ingr_stem
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        WHERE NOT EXISTS
+            (SELECT 1 FROM unknowns_per_recipe u
+            WHERE u.recipe_id = r.recipe_id)
+        AND r.recipe_id IN ({values})
+        ORDER BY r.recipe_id
+        ''',
+    'all_recipes': 'SELECT recipe_id, title, url FROM recipes',
+    'recipe_ids_by_title': '''
+        SELECT recipe_id
+        FROM recipes
+        ORDER BY title COLLATE NOCASE, recipe_id
+        ''',
+    'recipe_ids_by_num_ingredients': '''
+        SELECT r.recipe_id
+        FROM recipes r
+        LEFT JOIN recipes_ingredients ri USING(recipe_id)
+        GROUP BY r.recipe_id
+        ORDER BY count(ri.ingr_stem), r.recipe_id
+        ''',
+    'insert_ingredient': '''
+        INSERT INTO ingredients(name, ingr_stem)
+        VALUES (?, ?)
+        ''',
+    'ingredient_names': 'SELECT name FROM ingredients',
+    'ingredient_names_and_stems': 'SELECT name, ingr_stem FROM ingredients',
+    'recipe_ingredient_names': '''
+        SELECT ingr_name
+        FROM recipes_ingredients
+        WHERE recipe_id = (?)
+        ''',
+    'add_ingredient_to_recipe': '''
+        INSERT INTO recipes_ingredients(recipe_id, ingr_name, ingr_stem)
+        VALUES(?, ?, ?)
+        ''',
+    # Ignores ingredients repeated in a recipe.
+    'add_ingredient_to_recipe_once': '''
+        INSERT OR IGNORE INTO recipes_ingredients(recipe_id,
+                                                  ingr_name,
+                                                  ingr_stem)
+        VALUES(?, ?, ?)
+        ''',
+    'delete_recipe_ingredients': '''
+        DELETE FROM recipes_ingredients
+        WHERE recipe_id = (?)
+        ''',
+    'insert_unknown': '''
+        INSERT INTO ingr_unknowns(recipe_id, text_containing_ingr)
+        VALUES(?, ?)
+        ''',
+    'unknowns': '''
+        SELECT r.recipe_id, r.title, r.url, iu.text_containing_ingr
+        FROM recipes r
+        JOIN ingr_unknowns iu
+        USING(recipe_id)
+        ''',
+    'unknowns_limited': '''
+        SELECT r.recipe_id, r.title, r.url, iu.text_containing_ingr
+        FROM recipes r
+        JOIN ingr_unknowns iu
+        USING(recipe_id)
+        LIMIT (?)
+        ''',
+    'num_unknowns': 'SELECT num_unknowns FROM unknowns_total',
+    'delete_unknown': '''
+        DELETE FROM ingr_unknowns
+        WHERE text_containing_ingr = (?)
+        ''',
+    'delete_recipe_unknown': '''
+        DELETE FROM ingr_unknowns
+        WHERE text_containing_ingr = (?) AND recipe_id = (?)
+        ''',
+    'delete_recipe_unknowns': '''
+        DELETE FROM ingr_unknowns
+        WHERE recipe_id = (?)
+        ''',
+    'row_hashes': 'SELECT row_hash FROM recipe_rows',
+    'row_hash': '''
+        SELECT row_hash
+        FROM recipe_rows
+        WHERE recipe_id = (?)
+        ''',
+    'set_row_hash': '''
+        INSERT OR REPLACE INTO recipe_rows(recipe_id, row_hash)
+        VALUES(?, ?)
+        ''',
+    'delete_row_hash': '''
+        DELETE FROM recipe_rows
+        WHERE recipe_id = (?)
+        ''',
+    'loaded_file': '''
+        SELECT mtime_ns, size, digest
+        FROM loaded_files
+        WHERE path = (?)
+        ''',
+    'set_loaded_file': '''
+        INSERT OR REPLACE INTO loaded_files(path, mtime_ns, size, digest)
+        VALUES(?, ?, ?, ?)
+        ''',
+    'generation': 'SELECT generation FROM data_generation',
+    'bump_generation': '''
+        UPDATE data_generation
+        SET generation = generation + 1
+        ''',
+    # The current generation, with a NULL recipe id, then the changes.
+    'recipe_changes': '''
+        SELECT generation, NULL
+        FROM data_generation
+        UNION ALL
+        SELECT generation, recipe_id
+        FROM recipe_changes
+        WHERE generation > (?)
+        ''',
+    'prune_recipe_changes': '''
+        DELETE FROM recipe_changes
+        WHERE generation <= (SELECT generation FROM data_generation) - (?)
+        ''',
+}
+
+for _name, _query in _STATEMENTS.items():
+    if not _is_legal_sql(_query):
+        raise ValueError(f'Invalid SQL characters in statement {_name}')
+
+# Statements that can run on a read-only connection.
+_READING_STATEMENTS = frozenset(
+    name for name, query in _STATEMENTS.items()
+    if query.lstrip().upper().startswith('SELECT'))
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _statement(name: str, num_values: int = None) -> str:
+    """Return SQL of the statement name, for num_values values if needed."""
+    query = _STATEMENTS[name]
+    if num_values is not None:
+        query = query.format(values=', '.join('?' * num_values))
+    return query
+
+
+def _connect(database: str, **kwargs) -> sqlite3.Connection:
+    """Connect to database, a path or a "file:" URI."""
+    return sqlite3.connect(database, uri=database.startswith('file:'),
+                           **kwargs)
+
+
+def _is_in_memory(database: str) -> bool:
+    return database == ':memory:' or 'mode=memory' in database
+
+
+def _first_column(row: tuple):
+    return row[0]
+
+
+def _ingredient_from_row(row: tuple) -> Ingredient:
+    return Ingredient(row[0])
+
+
 class _SqlExecuter:
 
-    def __init__(self, db_path) -> None:
+    def __init__(self, db_path, read_only: bool = False) -> None:
         """
-        Creates an empty table. Ignores if a table named table_name already
-        exists in the database.
-
-        - db_name = file name of the database
-        - table_name = Name of the table
-        - fields = non-empty dict, where keys are fields' names and values
-            are fields constraints, separated by spaces.
-        - constraints = string of table-level constraints, separated by spaces.
+        Open a connection to the database at db_path, a path or a "file:"
+        URI, setting PRAGMAS.
+        The connection can be used from any thread, one at a time.
         """
 
         self._db_path = db_path
 
-        self._con = sqlite3.connect(db_path)
+        self._con = _connect(db_path,
+                             cached_statements=STATEMENT_CACHE_SIZE,
+                             check_same_thread=False)
         self._cur = self._con.cursor()
+        self._transaction_depth = 0
+
+        for name, value in PRAGMAS.items():
+            self._cur.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            self._cur.execute('PRAGMA query_only = ON')
+
+    def run(self, name: str, parameters=(), *,
+            num_values: int = None,
+            row_factory: Callable = None) -> list:
+        """
+        Execute the statement registered as name and return all its rows,
+        built by row_factory if given.
+        num_values: number of values in the "{values}" list, if any.
+        """
+        logging.debug(name)
+        with instrumentation.timer('query', name):
+            self._cur.execute(_statement(name, num_values), parameters)
+            rows = self._cur.fetchall()
+        if not self._transaction_depth:
+            self._commit()
+        if row_factory is None:
+            return rows
+        return [row_factory(row) for row in rows]
+
+    def run_many(self, name: str, seq_of_parameters):
+        """
+        Execute the statement registered as name once per parameters tuple
+        in seq_of_parameters.
+        """
+        logging.debug(name)
+        with instrumentation.timer('query', name):
+            self._cur.executemany(_statement(name), seq_of_parameters)
+        if not self._transaction_depth:
+            self._commit()
+
+    def iterate(self, name: str, parameters=(), *,
+                num_values: int = None,
+                row_factory: Callable = None,
+                batch_size: int = FETCH_BATCH_SIZE) -> Iterator:
+        """
+        Like run, but fetch rows batch_size at a time while they are
+        consumed. Meant for queries returning many rows.
+        """
+        logging.debug(name)
+        # Only the first batch is timed, the rest depends on the consumer.
+        with instrumentation.timer('query', name):
+            cursor = self._con.execute(_statement(name, num_values),
+                                       parameters)
+            rows = cursor.fetchmany(batch_size)
+        try:
+            while rows:
+                if row_factory is None:
+                    yield from rows
+                else:
+                    yield from map(row_factory, rows)
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
 
     def execute_query(self, query: str, parameters=()):
 
         logging.debug(query)
-        if not self._is_legal_sql(query):
+        if not _is_legal_sql(query):
             raise ValueError('Invalid SQL characters')
 
         self._cur.execute(query, parameters)
-        self._con.commit()
+        if not self._transaction_depth:
+            self._commit()
         return self._cur.fetchall()
 
-    def _is_legal_sql(self, query: str):
-        for c in _ILLEGAL_SQL_CHARS:
-            if c in query:
-                return False
-        return True
+    @contextmanager
+    def transaction(self):
+        """
+        Commit the queries executed inside the block all at once, or roll
+        them back if an exception escapes it.
+        Nested blocks are part of the outermost one.
+        """
+        self._transaction_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self._con.rollback()
+            raise
+        else:
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self._commit()
+
+    def _commit(self):
+        """Commit, if the statements run since the last commit wrote."""
+        if not self._con.in_transaction:
+            return
+        with instrumentation.timer('commit'):
+            self._con.commit()
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether a transaction block is open on this connection."""
+        return self._transaction_depth > 0
+
+    @property
+    def user_version(self) -> int:
+        [[version]] = self.execute_query('PRAGMA user_version')
+        return version
+
+    def migrate(self, migrations: list):
+        """
+        Apply the migrations the database hasn't gone through yet, each one
+        in its own transaction. See _MIGRATIONS.
+        Their statements aren't checked for illegal characters, since
+        triggers need semicolons: never build them from user input.
+        """
+        current_version = self.user_version
+        if current_version > len(migrations):
+            logging.warning(f'Database schema version {current_version} is '
+                            'newer than this program.')
+        for version, migration in enumerate(migrations[current_version:],
+                                            start=current_version + 1):
+            logging.info(f'Migrating database to version {version}.')
+            with self.transaction():
+                self._cur.execute('BEGIN')
+                for step in migration:
+                    if callable(step):
+                        step(self)
+                    else:
+                        logging.debug(step)
+                        self._cur.execute(step)
+                self._cur.execute(f'PRAGMA user_version = {version:d}')
+
+    @property
+    def last_row_id(self) -> int:
+        """Row id of the last row inserted through this connection."""
+        return self._cur.lastrowid
+
+    def create_function(self, name: str, num_params: int, func):
+        """Make a deterministic python function callable from SQL."""
+        self._con.create_function(name, num_params, func, deterministic=True)
+
+    def copy_from(self, database: str):
+        """Replace the contents of this database with those of database."""
+        source = _connect(database)
+        try:
+            source.backup(self._con)
+        finally:
+            source.close()
+
+    def copy_to(self, database: str):
+        """Replace the contents of database with those of this one."""
+        target = _connect(database)
+        try:
+            self._con.backup(target)
+        finally:
+            target.close()
+
+    def close(self):
+        self._con.close()
+
+
+class _ConnectionPool:
+    """
+    One connection to write with and num_readers read-only ones, shared
+    between threads. In WAL mode readers don't wait for the writer, nor
+    the writer for them.
+    Statements are run by name like with _SqlExecuter. Those in
+    _READING_STATEMENTS go to a free reader, unless the calling thread is
+    inside a transaction: then they go to the writer, to see its
+    uncommitted changes. Everything else waits for the writer.
+    """
+
+    def __init__(self, db_path, migrations: list,
+                 num_readers: int = NUM_READERS,
+                 source: str = None) -> None:
+        """
+        source: database copied into the one at db_path before migrating it.
+        """
+        self._writer = _SqlExecuter(db_path)
+        if source is not None:
+            self._writer.copy_from(source)
+        self._writer.migrate(migrations)
+        self._writer_lock = threading.RLock()
+
+        # Readers are opened after migrating, so they see the final schema.
+        self._readers = queue.SimpleQueue()
+        for _ in range(num_readers):
+            self._readers.put(_SqlExecuter(db_path, read_only=True))
+        self._num_readers = num_readers
+
+        # Connection and use count held by each thread, so nested queries
+        # don't wait for a connection the same thread holds.
+        self._local = threading.local()
+
+    @contextmanager
+    def _writing(self):
+        with self._writer_lock:
+            self._local.writing = getattr(self._local, 'writing', 0) + 1
+            try:
+                yield self._writer
+            finally:
+                self._local.writing -= 1
+
+    @contextmanager
+    def _reading(self):
+        if getattr(self._local, 'reading', 0):
+            self._local.reading += 1
+        else:
+            self._local.reader = self._readers.get()
+            self._local.reading = 1
+        try:
+            yield self._local.reader
+        finally:
+            self._local.reading -= 1
+            if not self._local.reading:
+                self._readers.put(self._local.reader)
+                self._local.reader = None
+
+    def _connection(self, name: str):
+        if (name in _READING_STATEMENTS
+                and self._num_readers
+                and not getattr(self._local, 'writing', 0)):
+            return self._reading()
+        return self._writing()
+
+    def run(self, name: str, parameters=(), **kwargs) -> list:
+        """See _SqlExecuter.run."""
+        with self._connection(name) as executer:
+            return executer.run(name, parameters, **kwargs)
+
+    def run_many(self, name: str, seq_of_parameters):
+        """See _SqlExecuter.run_many."""
+        with self._writing() as executer:
+            executer.run_many(name, seq_of_parameters)
+
+    def iterate(self, name: str, parameters=(), **kwargs) -> Iterator:
+        """
+        See _SqlExecuter.iterate. The connection is held until the iterator
+        is exhausted or closed.
+        """
+        with self._connection(name) as executer:
+            yield from executer.iterate(name, parameters, **kwargs)
+
+    @contextmanager
+    def transaction(self):
+        """
+        See _SqlExecuter.transaction. Other threads wait to write until the
+        block ends.
+        """
+        with self._writing() as executer, executer.transaction():
+            yield
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether the calling thread is inside a transaction block."""
+        return bool(getattr(self._local, 'writing', 0)
+                    and self._writer.in_transaction)
+
+    @property
+    def last_row_id(self) -> int:
+        """See _SqlExecuter.last_row_id. Call it inside a transaction."""
+        with self._writing() as executer:
+            return executer.last_row_id
+
+    def copy_to(self, database: str):
+        """See _SqlExecuter.copy_to. Waits for writes in progress."""
+        with self._writing() as executer:
+            executer.copy_to(database)
+
+    def close(self):
+        """Close all connections, waiting for the ones in use."""
+        with self._writing() as executer:
+            executer.close()
+        for _ in range(self._num_readers):
+            self._readers.get().close()
 
 
 class Interface:
     """
     Handles communication with the database.
+    Its methods can be called from any thread. Reads don't wait for each
+    other nor for writes, which happen one at a time. Use submit to run
+    them in background threads.
     """
 
-    def __init__(self) -> None:
-        self._executer = _SqlExecuter(database_path)
-        queries = []
-
-        tables = (
-            {
-                'name': 'recipes',
-                'fields': {
-                    'recipe_id': 'integer primary key autoincrement',
-                    'title': 'text unique',
-                    'url': 'text unique',
-                    # Both should be unique, not their combination.
-                }
-            },
-            {
-                'name': 'ingredients',
-                'fields': {
-                    'name': 'text primary key',
-                }
-            },
-            {
-                'name': 'recipes_ingredients',
-                'fields': {
-                    'recipe_id': 'integer',
-                    'ingr_name': 'text',
-                },
-                'constraints': [
-                    'primary key (recipe_id, ingr_name)',
-                    'foreign key (recipe_id) references recipes(recipe_id)',
-                    'foreign key (ingr_name) references ingredients(name)',
-                ]
-            },
-            {
-                'name': 'ingr_unknowns',
-                'fields': {
-                    'recipe_id': 'integer',
-                    'text_containing_ingr': 'text',
-                },
-                'constraints': (
-                    'foreign key (recipe_id) references recipes(recipe_id)',
-                )
-            },
-        )
-        queries.extend(_create_table_query(**table) for table in tables)
-
-        queries.append('''
-        CREATE VIEW IF NOT EXISTS recipes_with_unknowns
-        AS
-            SELECT *
-            FROM
-                (SELECT recipe_id, title, count(*) AS num_unkonwn_ingr
-                FROM ingr_unkowns
-                JOIN recipes using(recipe_id))
-        ''')
-
-        for query in queries:
-            self._executer.execute_query(query)
+    def __init__(self, database: str = database_path,
+                 num_readers: int = NUM_READERS,
+                 in_memory: bool = False) -> None:
+        """
+        database: path or "file:" URI of the database. In-memory databases,
+        ":memory:" or URIs with "mode=memory", only have the writing
+        connection. Use a URI with "cache=shared" to share one between
+        interfaces.
+        in_memory: work on a copy of database held in memory, written back
+        by snapshot and close.
+        """
+        self._source = database if in_memory else None
+        if in_memory:
+            database = ':memory:'
+        if _is_in_memory(database):
+            num_readers = 0
+        self._executer = _ConnectionPool(database, _MIGRATIONS, num_readers,
+                                         self._source)
+        self._tasks = ThreadPoolExecutor(max_workers=num_readers + 1,
+                                         thread_name_prefix='db')
         logging.info('Interface initialized.')
 
+    def snapshot(self, database: str = None):
+        """
+        Copy the whole database into database, by default the one loaded
+        in memory with in_memory. Runs between transactions.
+        """
+        database = database or self._source
+        if database is None:
+            raise ValueError('No database to snapshot to')
+        self._executer.copy_to(database)
+        logging.info(f'Database copied to {database}.')
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Call func(*args, **kwargs) in a background thread and return a
+        concurrent.futures.Future of its result. func is usually a method
+        of this interface, e.g.:
+            interface.submit(interface.get_recipes, ingredients)
+        From asyncio code, await asyncio.wrap_future(future).
+        """
+        return self._tasks.submit(func, *args, **kwargs)
+
+    def close(self):
+        """
+        Wait for submitted calls, then close the database connections.
+        A database loaded in memory is first written back.
+        """
+        self._tasks.shutdown()
+        if self._source is not None:
+            self.snapshot()
+        self._executer.close()
+
+    def transaction(self):
+        """
+        Return a context manager grouping all writes done inside it in a
+        single transaction. See _SqlExecuter.transaction.
+        """
+        return self._executer.transaction()
+
+    @property
+    def in_transaction(self) -> bool:
+        """
+        Whether the calling thread is inside a transaction block, so its
+        changes may still be rolled back. Read-only.
+        """
+        return self._executer.in_transaction
+
     def store_recipe(self, recipe: Recipe):
         """
-        Store recipe in database. Raise ValueError if recipe is already
-        present.
+        Store recipe in database and return its id. Raise ValueError if
+        recipe is already present.
 
         NOTE: Recipe will be stored with the ingredient names present in the
-        recipe, not those in the datbase.
+        recipe. When loaded from file, those are the names of the matching
+        ingredients in the database.
         """
-        query = '''
-            INSERT INTO recipes(title, url)
-            values(?, ?)
-            '''
         params = (recipe.title, recipe.url)
-        try:
-            self._executer.execute_query(query, params)
-        except sqlite3.IntegrityError:
+        with self.transaction():
+            try:
+                self._executer.run('insert_recipe', params)
+            except sqlite3.IntegrityError:
+                recipe_id = None
+            else:
+                recipe_id = self._executer.last_row_id
+                self._store_recipe_ingredients(recipe_id, recipe)
+                self._bump_generation()
+
+        if recipe_id is None:
             raise ValueError('Recipe already present')
-        else:
-            [[recipe_id]] = self._executer.execute_query(
-                'select last_insert_rowid()')
-
-            # Load any text with unknown ingredients in its corresponding table
-            query = '''
-                INSERT INTO ingr_unknowns(recipe_id, text_containing_ingr)
-                VALUES(?, ?)
-                '''
-            for text in recipe.ingredients_unknown:
-                params = (recipe_id, text)
-                self._executer.execute_query(query, params)
-
-            # Associate all known ingredients to recipe
-            for ingr in recipe.ingredients_known:
-                try:
-                    self._add_ingr_to_recipe(ingr, recipe_id)
-                except sqlite3.IntegrityError:
-                    # Duplicated ingredient in recipe
-                    pass
+        return recipe_id
+
+    def replace_recipe(self, recipe_id: int, recipe: Recipe):
+        """
+        Overwrite title, URL, ingredients and unknowns of a stored recipe.
+        Raise ValueError if the new title or URL belong to another recipe.
+        """
+        params = (recipe.title, recipe.url, recipe_id)
+        with self.transaction():
+            try:
+                self._executer.run('update_recipe', params)
+            except sqlite3.IntegrityError:
+                raise ValueError('Title or URL belong to another recipe')
+            for name in ('delete_recipe_ingredients',
+                         'delete_recipe_unknowns'):
+                self._executer.run(name, (recipe_id,))
+            self._store_recipe_ingredients(recipe_id, recipe)
+            self._bump_generation()
+
+    def _store_recipe_ingredients(self, recipe_id: int, recipe: Recipe):
+        # Load any text with unknown ingredients in its corresponding table
+        self._executer.run_many(
+            'insert_unknown',
+            ((recipe_id, text) for text in recipe.ingredients_unknown))
+
+        # Associate all known ingredients to recipe
+        self._executer.run_many(
+            'add_ingredient_to_recipe_once',
+            ((recipe_id, ingr.name, ingr.stem)
+             for ingr in recipe.ingredients_known))
+
+    def find_recipe_id(self, recipe_title: str, recipe_url: str):
+        """
+        Return the id of the recipe having either this exact title or URL,
+        or None.
+        """
+        params = (recipe_title, recipe_url)
+        result = self._executer.run('recipe_id_by_title_or_url', params)
+        return result[0][0] if result else None
+
+    def get_row_hashes(self) -> set[str]:
+        """Return hashes of all file rows stored recipes come from."""
+        return set(self._executer.iterate('row_hashes',
+                                          row_factory=_first_column))
+
+    def get_row_hash(self, recipe_id: int):
+        """Return hash of the file row recipe_id comes from, or None."""
+        result = self._executer.run('row_hash', (recipe_id,))
+        return result[0][0] if result else None
+
+    def set_row_hash(self, recipe_id: int, row_hash: str):
+        self._executer.run('set_row_hash', (recipe_id, row_hash))
+
+    def get_loaded_file(self, path: str):
+        """
+        Return (mtime_ns, size, digest) of path when it was last loaded,
+        or None if it never was.
+        """
+        result = self._executer.run('loaded_file', (path,))
+        return result[0] if result else None
+
+    def set_loaded_file(self, path: str, mtime_ns: int, size: int,
+                        digest: str):
+        params = (path, mtime_ns, size, digest)
+        self._executer.run('set_loaded_file', params)
 
     def get_recipes(self, ingr_included: list[Ingredient] = []) -> list[Recipe]:
+        """
+        Return recipes containing all ingredients in ingr_included, ordered by
+        id. Recipes with unknown ingredients are omitted.
+        """
+        stems_included = list({ingr.stem for ingr in ingr_included})
+        if stems_included:
+            rows = self._executer.iterate(
+                'recipes_without_unknowns_by_stems',
+                (*stems_included, len(stems_included)),
+                num_values=len(stems_included))
+        else:
+            rows = self._executer.iterate('recipes_without_unknowns')
+        return self._recipes_from_rows(rows)
 
-        # Omit recipes containing unknown ingredients
-        to_omit_ids = {id for id, *_ in self.get_unknowns()}
+    def get_recipes_by_id(self, recipe_ids: list[int]) -> list[Recipe]:
+        """
+        Return the recipes with the given ids, in the same order. Ids not
+        present in the database are skipped.
+        """
+        by_id = {}
+        for index in range(0, len(recipe_ids), _MAX_SQL_PARAMS):
+            ids_slice = recipe_ids[index:index+_MAX_SQL_PARAMS]
+            rows = self._executer.iterate('recipes_by_id', ids_slice,
+                                          num_values=len(ids_slice))
+            by_id.update((recipe.recipe_id, recipe)
+                         for recipe in self._recipes_from_rows(rows))
+        return [by_id[id] for id in recipe_ids if id in by_id]
 
-        # Get all recipes
-        query = '''
-        SELECT recipe_id, title, url
-        FROM recipes
-        '''
-        recipes = {
-            recipe_id: Recipe(title, url, self.get_ingredients(recipe_id))
-            for [recipe_id, title, url] in self._executer.execute_query(query)
-        }
+    def get_recipe_stems(self,
+                         recipe_ids: list[int] = None
+                         ) -> Iterator[tuple[int, str]]:
+        """
+        Return iterator of (recipe_id, ingredient_stem) pairs of the recipes
+        without unknowns, ordered by recipe id, only of recipe_ids if given.
+        Recipes without ingredients have a single pair with stem None.
+        """
+        if recipe_ids is None:
+            return self._executer.iterate('recipe_stems')
+        recipe_ids = sorted(recipe_ids)
+        return itertools.chain.from_iterable(
+            self._executer.iterate('recipe_stems_by_id', ids_slice,
+                                   num_values=len(ids_slice))
+            for ids_slice in (recipe_ids[index:index+_MAX_SQL_PARAMS]
+                              for index in range(0, len(recipe_ids),
+                                                 _MAX_SQL_PARAMS)))
 
-        result = []
-        for recipe_id, recipe in recipes.items():
-            if recipe_id in to_omit_ids:
-                continue
-            if all(ingr in recipe.ingredients_known for ingr in ingr_included):
-                result.append(recipe)
+    def get_ordered_recipe_ids(self, order: str) -> Iterator[int]:
+        """
+        Return iterator of all recipe ids, sorted by 'title' or by
+        'num_ingredients'.
+        """
+        return self._executer.iterate(f'recipe_ids_by_{order}',
+                                      row_factory=_first_column)
 
-        return result
+    @staticmethod
+    def _recipes_from_rows(rows) -> list[Recipe]:
+        """
+        Group (recipe_id, title, url, ingr_name) rows, ordered by recipe_id,
+        into recipes.
+        """
+        return [
+            Recipe(title, url,
+                   [Ingredient(ingr_name)
+                    for *_, ingr_name in group
+                    if ingr_name is not None],
+                   recipe_id=recipe_id)
+            for (recipe_id, title, url), group
+            in itertools.groupby(rows, key=lambda row: row[:3])
+        ]
 
     def get_recipe_id(self, recipe_title: str, recipe_url: str) -> int:
-        query = '''
-        SELECT recipe_id, title, url
-        FROM recipes
-        '''
-        recipes = self._executer.execute_query(query)
-        dict_ = {(title.lower(), url.lower()): id
-                 for id, title, url in recipes}
-
-        return dict_[(recipe_title.lower(), recipe_url.lower())]
+        """
+        Return the id of the recipe, comparing title and URL without
+        case. Raise KeyError if not found.
+        """
+        params = (recipe_title, recipe_url)
+        result = self._executer.run('recipe_id', params)
+        if not result:
+            raise KeyError((recipe_title, recipe_url))
+        [[recipe_id]] = result
+        return recipe_id
 
     def delete_recipe(self, recipe_id: int):
         """Permanently delete recipe information from the database."""
-        queries = [
-            '''
-            DELETE FROM recipes_ingredients
-            WHERE recipe_id = (?)
-            ''',
-            '''
-            DELETE FROM ingr_unknowns
-            WHERE recipe_id = (?)
-            ''',
-            '''
-            DELETE FROM recipes
-            WHERE recipe_id = (?)
-            '''
-        ]
+        names = ('delete_recipe_ingredients',
+                 'delete_recipe_unknowns',
+                 'delete_row_hash',
+                 'delete_recipe')
         params = (recipe_id,)
-        print(*self.get_recipes(), "\n\n")
-        for recipe in self.get_recipes():
-            print(self.get_recipe_id(recipe.title, recipe.url), recipe)
-        for query in queries:
-            self._executer.execute_query(query, params)
-        print(f'\nDeleted {recipe_id=}')
+        with self.transaction():
+            for name in names:
+                self._executer.run(name, params)
+            self._bump_generation()
+        logging.info(f'Deleted {recipe_id=}')
 
     def store_ingredient(self, ingr: Ingredient):
         """Store ingredient into database."""
-        query = '''
-        INSERT INTO ingredients(name)
-        VALUES (?)
-        '''
-        params = (ingr.name,)
+        self.store_ingredients([ingr])
+
+    def store_ingredients(self, ingredients: Iterable[Ingredient]):
+        """
+        Store ingredients into database in a single transaction. Raise
+        ValueError, storing none of them, if one is already present.
+        """
         try:
-            self._executer.execute_query(query, params)
+            with self.transaction():
+                self._executer.run_many(
+                    'insert_ingredient',
+                    ((ingr.name, ingr.stem) for ingr in ingredients))
+                self._bump_generation()
         except sqlite3.IntegrityError:
             raise ValueError('Ingredient already present')
 
+    def get_ingredient_stems(self) -> dict[str, str]:
+        """Return {name: stem} of all stored ingredients."""
+        return dict(self._executer.iterate('ingredient_names_and_stems'))
+
+    @property
+    def generation(self) -> int:
+        """
+        Counter increased, in the same transaction, by every change to
+        recipes, ingredients or unknowns made through an Interface, also by
+        other processes. Read-only.
+        """
+        [[generation]] = self._executer.run('generation')
+        return generation
+
+    def _bump_generation(self):
+        self._executer.run('bump_generation')
+        self._executer.run('prune_recipe_changes', (RECIPE_CHANGES_KEPT,))
+
+    def get_recipe_changes(self, since: int) -> tuple[int, set[int]]:
+        """
+        Return the current generation and the ids of the recipes added,
+        changed or deleted after generation since, as one snapshot. The ids
+        are None if changes that old are no longer kept, see
+        RECIPE_CHANGES_KEPT.
+        """
+        rows = self._executer.run('recipe_changes', (since,))
+        [generation] = [gen for gen, recipe_id in rows if recipe_id is None]
+        if generation - since > RECIPE_CHANGES_KEPT:
+            return generation, None
+        return generation, {recipe_id for _, recipe_id in rows
+                            if recipe_id is not None}
+
     def get_ingredient_names(self, recipe_id: int = None) -> list[str]:
         """
-        Return sorted list of ingredient names, capitalized on the first letter
+        Return list of ingredient names, of recipe_id if given.
         """
         if recipe_id:
-            query = '''
-            SELECT ingr_name
-            FROM recipes_ingredients
-            WHERE recipe_id = (?)
-            '''
-            params = (recipe_id,)
-        else:
-            query = 'SELECT name FROM ingredients'
-            params = ()
-
-        ingr_list = [ingr_name
-                     for [ingr_name]
-                     in self._executer.execute_query(query, params)]
-        return ingr_list
+            return self._executer.run('recipe_ingredient_names',
+                                      (recipe_id,),
+                                      row_factory=_first_column)
+        return self._executer.run('ingredient_names',
+                                  row_factory=_first_column)
 
-    def get_ingredients(self, recipe_id: int = None) -> list[Ingredient]:
-        return [Ingredient(ingr_name)
-                for ingr_name in self.get_ingredient_names(recipe_id)]
+    def get_ingredients(self,
+                        recipe_id: int = None) -> Iterable[Ingredient]:
+        """
+        Return list of the ingredients of recipe_id if given, otherwise
+        iterator of all stored ingredients, streamed from the database.
+        """
+        if recipe_id:
+            return self._executer.run('recipe_ingredient_names',
+                                      (recipe_id,),
+                                      row_factory=_ingredient_from_row)
+        return self._executer.iterate('ingredient_names',
+                                      row_factory=_ingredient_from_row)
 
     def print_recipes(self):
-        query = 'select * from recipes'
-        results = self._executer.execute_query(query)
-        for result in results:
+        for result in self._executer.iterate('all_recipes'):
             print("\n")
             print(*result, sep="\n")
-            query = 'select ingr_name '\
-                'from recipes_ingredients '\
-                'where recipe_id = (?)'
             params = (result[0],)
-            ingredients = self._executer.execute_query(
-                query, params)
+            ingredients = self._executer.run('recipe_ingredient_names',
+                                             params)
             for ingredient in ingredients:
                 print("  -", *ingredient)
 
     @property
     def num_unknowns(self):
         """Number of unknowns to review. Read-only."""
-        query = '''
-            SELECT count(*)
-            FROM recipes r
-            JOIN ingr_unknowns iu
-            USING(recipe_id)
-        '''
-        [[count]] = self._executer.execute_query(query)
+        [[count]] = self._executer.run('num_unknowns')
         return count
 
-    def get_unknowns(self, limit: int = 0) -> list[tuple]:
+    def get_unknowns(self, limit: int = 0) -> Iterable[tuple]:
         """
-        Return unknowns as a list of tuples:
+        Return unknowns as tuples:
             (recipe_id, recipe_title, recipe_url, text_with_unknown)
-        limit: number of unknowns to return. Return all unknowns if limit is 0.
+        limit: number of unknowns to return, as a list. If 0, return iterator
+        of all unknowns, streamed from the database.
         """
         # Search is executed each time to refresh the list of results after
         # a new ingredient has been added to the database.
-        query = '''
-            SELECT r.recipe_id, r.title, r.url, iu.text_containing_ingr
-            FROM recipes r
-            JOIN ingr_unknowns iu
-            USING(recipe_id)
-        '''
         if limit:
-            query = query + f'\nLIMIT {limit}'
-        try:
-            result = self._executer.execute_query(query)
-        except ValueError:
-            raise ValueError('No unknowns left to review.')
-        return result
+            return self._executer.run('unknowns_limited', (limit,))
+        return self._executer.iterate('unknowns')
 
     def solve_unknown(self,
                       recipe_id: int,
@@ -320,26 +1192,29 @@ class Interface:
         wrapper, call Loader().solve_unknown.
         NOTE: Make sure the ingredient is saved first, using store_ingredient
         """
-        # Delete text from ingr_unknowns table
-        self.delete_unknown(text_with_unkown)
-        self._add_ingr_to_recipe(extracted_ingr, recipe_id)
+        with self.transaction():
+            # Delete text from ingr_unknowns table
+            self.delete_unknown(text_with_unkown, recipe_id)
+            self._add_ingr_to_recipe(extracted_ingr, recipe_id)
+            self._bump_generation()
 
         logging.info(f'Extracted "{extracted_ingr.name}" ' \
             f'from "{text_with_unkown}"')
 
-    def delete_unknown(self, text_with_unknown):
-        query = '''
-        DELETE FROM ingr_unknowns
-        WHERE text_containing_ingr = (?)
-        '''
-        params = (text_with_unknown,)
-        self._executer.execute_query(query, params)
+    def delete_unknown(self, text_with_unknown, recipe_id: int = None):
+        """
+        Delete text_with_unknown from the unknowns of recipe_id, or of all
+        recipes if recipe_id is None.
+        """
+        with self.transaction():
+            if recipe_id is None:
+                self._executer.run('delete_unknown', (text_with_unknown,))
+            else:
+                self._executer.run('delete_recipe_unknown',
+                                   (text_with_unknown, recipe_id))
+            self._bump_generation()
 
     def _add_ingr_to_recipe(self, ingr: Ingredient, recipe_id: int):
         """Associate ingredient to corresponding recipe"""
-        query = '''
-            INSERT INTO recipes_ingredients(recipe_id, ingr_name)
-            VALUES(?, ?)
-            '''
-        params = (recipe_id, ingr.name)
-        self._executer.execute_query(query, params)
+        params = (recipe_id, ingr.name, ingr.stem)
+        self._executer.run('add_ingredient_to_recipe', params)
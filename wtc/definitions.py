@@ -1,5 +1,43 @@
 """Recipe class definition"""
 
+import functools
+import threading
+from typing import Iterable
+
+import instrumentation
+
+# Maximum number of distinct names whose stem is remembered.
+STEM_CACHE_SIZE = 2 ** 16
+
+# Stemmers keep their state while stemming a word, so they are shared per
+# language but never used by two threads at once.
+_stemmers = {}
+_stemmers_lock = threading.RLock()
+
+
+def get_stemmer(language: str = 'italian'):
+    """Return the shared stemmer for language, creating it on first use."""
+    with _stemmers_lock:
+        try:
+            return _stemmers[language]
+        except KeyError:
+            import snowballstemmer as sb
+
+            stemmer = _stemmers[language] = sb.stemmer(language)
+            return stemmer
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(name: str, language: str = 'italian') -> str:
+    """Return the stem of name. Results are memoized."""
+    with instrumentation.timer('stem'), _stemmers_lock:
+        return get_stemmer(language).stemWord(name)
+
+
+def stem_cache_info():
+    """Return hits, misses, maxsize and currsize of the stem cache."""
+    return stem.cache_info()
+
 
 class Ingredient:
     """
@@ -9,25 +47,32 @@ class Ingredient:
     TODO configure ingredient language. Right now supports italian only.
     """
 
+    __slots__ = ('_name', '_stem')
+
     def __init__(self, name: str) -> None:
         """
         Create an ingredient instance.
         name should be a singular noun, preferrably one word only.
         """
-        import snowballstemmer as sb
-
         self._name = name.lower().strip()
-
-        stemmer = sb.stemmer('italian')
-        self._stem = stemmer.stemWord(self._name)
+        self._stem = stem(self._name)
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def stem(self):
+        return self._stem
+
     def __eq__(self, other) -> bool:
+        if not isinstance(other, Ingredient):
+            return NotImplemented
         return self._stem == other._stem
 
+    def __hash__(self) -> int:
+        return hash(self._stem)
+
     def __repr__(self) -> str:
         return f'Ingredient({self.name})'
 
@@ -35,69 +80,78 @@ class Ingredient:
         return self.name
 
 
-class Recipe(object):
+class Recipe:
     """
-    Group information and actions relevant to a recipe.
+    Read-only record of the information relevant to a recipe.
     title: The title of the recipe.
     url: The URL of the recipe.
-    ingredients: List of ingredients the recipe contains."""
+    ingredients_known: Ingredients the recipe contains.
+    ingredients_unknown: Texts where no known ingredient was found.
+    recipe_id: Database id, if the recipe was read from the database.
+
+    Recipes are compared by title, URL, ingredient stems and unknown texts.
+    """
+
+    __slots__ = ('_recipe_id', '_title', '_url', '_ingredients_known',
+                 '_ingredients_unknown', '_stems')
 
     def __init__(self, title: str = None, url: str = None,
-                 ingredients_known: list[Ingredient] = [],
-                 ingredients_unknown: list[str] = []):
+                 ingredients_known: Iterable[Ingredient] = (),
+                 ingredients_unknown: Iterable[str] = (),
+                 recipe_id: int = None):
+        self._recipe_id = recipe_id
         self._title = title
         self._url = url
-        self._ingredients_known = ingredients_known
-        self._ingredients_unknown = ingredients_unknown
+        self._ingredients_known = tuple(ingredients_known)
+        self._ingredients_unknown = tuple(ingredients_unknown)
+        self._stems = frozenset(ingr.stem for ingr in self._ingredients_known)
+
+    @property
+    def recipe_id(self):
+        return self._recipe_id
 
     @property
     def title(self):
         return self._title
 
-    @title.setter
-    def title(self, title):
-        self._title = title
-
     @property
     def url(self):
         return self._url
 
-    @url.setter
-    def url(self, url):
-        self._url = url
-
     @property
-    def ingredients_known(self):
+    def ingredients_known(self) -> tuple[Ingredient, ...]:
         return self._ingredients_known
 
-    @ingredients_known.setter
-    def ingredients_known(self, ingr_names: list):
-        self._ingredients_known = list(ingr_names)
-
     @property
-    def ingredients_unknown(self):
+    def ingredients_unknown(self) -> tuple[str, ...]:
         return self._ingredients_unknown
 
-    @ingredients_unknown.setter
-    def ingredients_unknown(self, ingr_names: list):
-        self._ingredients_unknown = list(ingr_names)
+    @property
+    def stems(self) -> frozenset[str]:
+        """Stems of the known ingredients."""
+        return self._stems
 
     def has_unknowns(self):
-        return (True if self.ingredients_unknown else False)
+        return bool(self._ingredients_unknown)
 
     def __str__(self):
         return f'{self.title}\n'\
             + f'{self.url}\n'\
             + f'{", ".join(str(i) for i in self.ingredients_known)}'
 
+    def __repr__(self) -> str:
+        return f'Recipe({self.title!r}, {self.url!r})'
+
     def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, Recipe):
+            return NotImplemented
         return (
-            self.title == __o.title
-            and self.url == __o.url
-            and len(self.ingredients_known) == len(__o.ingredients_known)
-            and all(True if ingr in self.ingredients_known else False
-                    for ingr in self.ingredients_known)
-            and len(self.ingredients_unknown) == len(__o.ingredients_unknown)
-            and all(True if ingr in self.ingredients_unknown else False
-                    for ingr in self.ingredients_unknown)
+            self._title == __o._title
+            and self._url == __o._url
+            and self._stems == __o._stems
+            and (frozenset(self._ingredients_unknown)
+                 == frozenset(__o._ingredients_unknown))
         )
+
+    def __hash__(self) -> int:
+        return hash((self._title, self._url, self._stems))
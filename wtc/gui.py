@@ -1,5 +1,8 @@
 import logging
+import os
+import threading
 import webbrowser
+from bisect import bisect_left
 
 from kivy.lang import Builder
 from kivy.app import App
@@ -19,13 +22,30 @@ from kivy.uix.screenmanager import ScreenManager, Screen, SlideTransition
 
 from kivy.uix.behaviors import ButtonBehavior
 
-from kivy.properties import (
-    ListProperty, AliasProperty, StringProperty, NumericProperty)
+from kivy.properties import ListProperty, StringProperty, NumericProperty
 
-from processing import Loader, Searcher
+import instrumentation
+from processing import IngrCompleter, Loader, RecipeResults, Searcher
 from definitions import Ingredient
 
-Builder.load_file('gui.kv')
+KV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gui.kv')
+
+# Processes extracting ingredients while loading recipes, leaving a core
+# for the interface.
+LOAD_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+# Seconds during which ingredient (de)selections are gathered before
+# updating the lists showing them.
+SELECTION_UPDATE_DELAY = 0.05
+# Another page of results is shown when scrolling past this fraction of
+# the ones shown, from the top.
+RESULTS_LOAD_AHEAD = 0.2
+# Orders results can be sorted by, by name shown. The first one, the order
+# searches return without sorting, is the default.
+RESULT_ORDERS = {
+    'Loaded first': 'id',
+    'By title': 'title',
+    'Fewest ingredients': 'num_ingredients',
+}
 
 
 class ChooseFilePopup(Popup):
@@ -73,8 +93,29 @@ class SidePanel(BoxLayout):
         else:
             self.ids.review_button.disabled = False
 
-    def update_load_label(self, num_new_recipes):
-        if num_new_recipes == 0:
+    def show_loading(self, loading: bool):
+        self.ids.load_button.disabled = loading
+        self.ids.cancel_button.disabled = not loading
+        if loading:
+            self.ids.review_button.disabled = True
+            self.ids.load_label.text = 'Loading recipes...'
+        else:
+            self.on_num_pending_ingredients(self,
+                                            self.num_pending_ingredients)
+
+    def update_load_progress(self, progress: dict):
+        self.ids.load_label.text = (
+            f'{progress["rows_read"]} rows read, '
+            f'{progress["loaded"]} loaded,\n'
+            f'{progress["with_unknowns"]} with unknowns, '
+            f'{progress["errors"]} errors '
+            f'({progress["rows_per_second"]:.0f} rows/s)')
+
+    def update_load_label(self, num_new_recipes, cancelled=False):
+        if cancelled:
+            self.ids.load_label.text = f'Loading cancelled, {num_new_recipes}'\
+                ' new recipes loaded.'
+        elif num_new_recipes == 0:
             self.ids.load_label.text = 'No new recipes were loaded.'
         else:
             self.ids.load_label.text = f'{num_new_recipes} '\
@@ -94,7 +135,80 @@ class RecipeCard(ButtonBehavior, BoxLayout):
 
 
 class ResultsScreen(Screen):
+    """
+    Recipes found by a search. They're fetched a page at a time, when
+    scrolling near the end of the ones shown.
+    """
     data = ListProperty()
+    order_name = StringProperty(next(iter(RESULT_ORDERS)))
+    order_names = ListProperty(list(RESULT_ORDERS))
+
+    def __init__(self, **kwargs):
+        self._results = None
+        self._next_page = 0
+        # Bound to the height of the results layout while a page is added.
+        self._keep_offset = None
+        super(ResultsScreen, self).__init__(**kwargs)
+
+    @property
+    def order(self) -> str:
+        return RESULT_ORDERS[self.order_name]
+
+    def show_results(self, results: RecipeResults):
+        self._results = results
+        self._next_page = 0
+        self._stop_keeping_offset()
+        self.data = []
+        self.load_next_page()
+
+    def _stop_keeping_offset(self):
+        if self._keep_offset is not None:
+            self.ids.results_rv.layout_manager.unbind(
+                height=self._keep_offset)
+            self._keep_offset = None
+
+    def _keep_scroll_offset(self):
+        """
+        Keep the results scrolled the same pixels from the top once the
+        layout grows. scroll_y is a fraction of the height, so otherwise the
+        view would jump forward.
+        """
+        self._stop_keeping_offset()
+        results_rv = self.ids.results_rv
+        layout = results_rv.layout_manager
+        offset = ((1 - results_rv.scroll_y)
+                  * max(layout.height - results_rv.height, 0))
+
+        def keep_offset(instance, height):
+            self._stop_keeping_offset()
+            scrollable = height - results_rv.height
+            if scrollable > 0:
+                results_rv.scroll_y = max(0.0, 1 - offset / scrollable)
+
+        self._keep_offset = keep_offset
+        layout.bind(height=keep_offset)
+
+    @instrumentation.timed('gui.results_page')
+    def load_next_page(self):
+        if (self._results is None
+                or self._next_page >= self._results.num_pages):
+            return
+        if self.data:
+            self._keep_scroll_offset()
+        self.data.extend(
+            {
+                'recipe_id': recipe.recipe_id,
+                'recipe_title': recipe.title,
+                'recipe_url': recipe.url,
+                'ingredients': recipe.ingredients_known
+            }
+            for recipe in self._results.page(self._next_page))
+        self._next_page += 1
+
+    def on_scroll(self, scroll_y):
+        # scroll_y goes from 1 at the top to 0 at the bottom.
+        if scroll_y < RESULTS_LOAD_AHEAD:
+            self.load_next_page()
 
 
 class AvailableIngrItem(Button):
@@ -118,21 +232,145 @@ class SearchHeader(BoxLayout):
 
 
 class SearchScreen(Screen):
-
+    """
+    Ingredients to search recipes with, split into selected and available.
+    (De)selecting one only moves its row between the two lists, and changes
+    made within SELECTION_UPDATE_DELAY are applied together.
+    Available ingredients are only shown if they match filter_text.
+    """
+
+    # Every ingredient, as {'ingr_name': str, 'selected': bool}.
     data = ListProperty()
+    data_selected = ListProperty()
+    # In the same order as data.
+    data_available = ListProperty()
+    filter_text = StringProperty()
 
-    def get_selected_ingredients(self) -> list[str]:
+    def __init__(self, **kwargs):
+        self._index = {}
+        self._completer = IngrCompleter()
+        # Indexes in data of the ingredients matching filter_text, or None
+        # if there's no filter.
+        self._matching = None
+        # Indexes in data of the rows in data_available, ascending.
+        self._available_indexes = []
+        self._changed = set()
+        self._update_trigger = Clock.create_trigger(self._update_lists,
+                                                    SELECTION_UPDATE_DELAY)
+        # Set while add_ingredient changes data, which it keeps in step.
+        self._adding = False
+        super(SearchScreen, self).__init__(**kwargs)
+
+    def on_data(self, instance, value):
+        if self._adding:
+            return
+        self._index = {item['ingr_name']: index
+                       for index, item in enumerate(value)}
+        self._completer = IngrCompleter(self._index)
+        self._changed.clear()
+        self.data_selected = self.get_selected_ingredients()
+        self.on_filter_text(self, self.filter_text)
+
+    @instrumentation.timed('gui.filter')
+    def on_filter_text(self, instance, value):
+        if value.strip():
+            self._matching = {self._index[name]
+                              for name in self._completer.complete(value)}
+            candidates = sorted(self._matching)
+        else:
+            self._matching = None
+            candidates = range(len(self.data))
+        self._available_indexes = [index for index in candidates
+                                   if not self.data[index]['selected']]
+        self.data_available = [{'ingr_name': self.data[index]['ingr_name']}
+                               for index in self._available_indexes]
+
+    @instrumentation.timed('gui.add_ingredient')
+    def add_ingredient(self, ingr_name: str):
+        """
+        Insert a new, unselected ingredient in order, updating the indexes
+        and the available list instead of rebuilding them from data.
+        """
+        if self.has_ingredient(ingr_name):
+            return
+        position = bisect_left(self.data, ingr_name,
+                               key=lambda item: item['ingr_name'])
+        self._adding = True
+        try:
+            self.data.insert(position,
+                             {'ingr_name': ingr_name, 'selected': False})
+        finally:
+            self._adding = False
+
+        # Rows after the new one move one place down.
+        def shift(index: int) -> int:
+            return index + 1 if index >= position else index
+        for name, index in self._index.items():
+            if index >= position:
+                self._index[name] = index + 1
+        self._index[ingr_name] = position
+        self._available_indexes = [shift(index)
+                                   for index in self._available_indexes]
+        self._changed = {shift(index) for index in self._changed}
+        self._completer.add(ingr_name)
+        if self._matching is not None:
+            self._matching = {shift(index) for index in self._matching}
+            if ingr_name in self._completer.complete(self.filter_text):
+                self._matching.add(position)
+
+        if self._is_shown(position):
+            available_position = bisect_left(self._available_indexes,
+                                             position)
+            self._available_indexes.insert(available_position, position)
+            self.data_available.insert(available_position,
+                                       {'ingr_name': ingr_name})
+
+    def _is_shown(self, index: int) -> bool:
+        return (not self.data[index]['selected']
+                and (self._matching is None or index in self._matching))
+
+    def has_ingredient(self, ingr_name: str) -> bool:
+        return ingr_name in self._index
+
+    def get_selected_ingredients(self) -> list[dict]:
         return [{'ingr_name': item['ingr_name']}
                 for item in self.data
                 if item['selected']]
 
-    def get_available_ingredients(self) -> list[str]:
+    def get_available_ingredients(self) -> list[dict]:
         return [{'ingr_name': item['ingr_name']}
                 for item in self.data
                 if not item['selected']]
 
-    data_selected = AliasProperty(get_selected_ingredients, bind=['data'])
-    data_available = AliasProperty(get_available_ingredients, bind=['data'])
+    def set_selected(self, ingr_name: str, selected: bool):
+        """(De)select ingredient, updating the lists shortly after."""
+        index = self._index.get(ingr_name)
+        if index is None:
+            return
+        self.data[index]['selected'] = selected
+        self._changed.add(index)
+        self._update_trigger()
+
+    @instrumentation.timed('gui.selection')
+    def _update_lists(self, dt):
+        changed, self._changed = self._changed, set()
+        for index in sorted(changed):
+            item = self.data[index]
+            position = bisect_left(self._available_indexes, index)
+            is_available = (position < len(self._available_indexes)
+                            and self._available_indexes[position] == index)
+            row = {'ingr_name': item['ingr_name']}
+            if is_available and not self._is_shown(index):
+                del self._available_indexes[position]
+                del self.data_available[position]
+            elif not is_available and self._is_shown(index):
+                self._available_indexes.insert(position, index)
+                self.data_available.insert(position, row)
+
+            if item['selected'] and row not in self.data_selected:
+                self.data_selected.append(row)
+            elif not item['selected'] and row in self.data_selected:
+                self.data_selected.remove(row)
 
 
 class Manager(ScreenManager):
@@ -145,12 +383,23 @@ class MainBoard(RelativeLayout):
 
 class WtcApp(App):
 
-    def __init__(self, loader: Loader, searcher: Searcher, **kwargs):
+    def __init__(self, loader: Loader, searcher: Searcher,
+                 on_started=None, **kwargs):
+        """on_started: called without arguments once the window is shown."""
         super(WtcApp, self).__init__(**kwargs)
         self.loader = loader
         self.searcher = searcher
+        self._on_started = on_started
+        self._load_thread = None
+        self._cancel_load = threading.Event()
+        # Ingredients of the last search, None before searching.
+        self._ingr_included = None
 
     def build(self):
+        # Loaded here rather than at import, so importing this module stays
+        # cheap.
+        Builder.load_file(KV_PATH)
+
         self.search_screen = SearchScreen(name='search_screen')
         self.results_screen = ResultsScreen(name='results_screen')
 
@@ -180,10 +429,12 @@ class WtcApp(App):
     def load_ingredients(self):
         ordered_ingr_names = sorted(ingr.name.capitalize()
                                     for ingr in self.searcher.get_ingredients())
+        selected = {item['ingr_name']
+                    for item in self.search_screen.get_selected_ingredients()}
 
         self.search_screen.data = [{
             'ingr_name': ingr_name,
-            'selected': False
+            'selected': ingr_name in selected
         }
             for ingr_name in ordered_ingr_names]
         logging.info(f'Loaded {len(self.search_screen.data)} ingredient/s.')
@@ -212,28 +463,68 @@ class WtcApp(App):
             self.review_popup.dismiss()
 
     def save_ingr_review(self, recipe_id, text_with_unknown, ingr_name):
+        ingr = Ingredient(ingr_name)
         try:
-            self.loader.solve_unknown(
-                recipe_id, text_with_unknown, Ingredient(ingr_name))
+            self.loader.solve_unknown(recipe_id, text_with_unknown, ingr)
         except ValueError:
             self.review_popup.alert_wrong()
-
-        self.load_ingredients()
-        self.refresh_search_data()
+        else:
+            # Only a new ingredient is added, nothing is reloaded.
+            self.search_screen.add_ingredient(ingr.name.capitalize())
         self.update_num_pending_ingredients()
         self.review_next_ingr()
 
     def delete_unknown(self, text_with_unknown):
         self.loader.delete_unknown(text_with_unknown)
-        self.refresh_search_data()
         self.update_num_pending_ingredients()
         self.review_next_ingr()
 
     def load_recipes(self):
-        successes, *_ = self.loader.load_recipes()
-        self.panel.update_load_label(successes)
+        """
+        Load recipes in a background thread, showing its progress on the
+        side panel.
+        """
+        if self._load_thread is not None:
+            return
+        self._cancel_load.clear()
+        self.panel.show_loading(True)
+        self._load_thread = threading.Thread(target=self._load_in_background,
+                                             name='load_recipes',
+                                             daemon=True)
+        self._load_thread.start()
+
+    def _load_in_background(self):
+        # Runs in the loading thread: widgets are only touched from Clock
+        # callbacks, on the main thread.
+        try:
+            successes, *_ = self.loader.load_recipes(
+                workers=LOAD_WORKERS,
+                progress=lambda progress: Clock.schedule_once(
+                    lambda dt: self.panel.update_load_progress(progress)),
+                cancel=self._cancel_load)
+        except Exception:
+            logging.exception('Loading recipes failed.')
+            successes = 0
+        Clock.schedule_once(lambda dt: self._end_loading(successes))
+
+    def _end_loading(self, successes):
+        self._load_thread = None
+        self.panel.show_loading(False)
+        self.panel.update_load_label(successes, self._cancel_load.is_set())
         self.update_num_pending_ingredients()
 
+    def cancel_loading(self):
+        self._cancel_load.set()
+
+    def on_start(self):
+        if self._on_started is not None:
+            Clock.schedule_once(lambda dt: self._on_started())
+
+    def on_stop(self):
+        if self._load_thread is not None:
+            self._cancel_load.set()
+            self._load_thread.join()
+
     def delete_recipe(self, recipe_id):
         self.loader.delete_recipe(recipe_id)
         for index, dict in enumerate(self.results_screen.data):
@@ -241,42 +532,32 @@ class WtcApp(App):
                 del self.results_screen.data[index]
                 return
 
-    def refresh_search_data(self):
-        data = self.search_screen.data
-        self.search_screen.data = []
-        self.search_screen.data = data
-
     def select_ingr(self, ingr_name: str):
-        for index, item in enumerate(self.search_screen.data):
-            if item['ingr_name'] == ingr_name:
-                self.search_screen.data[index]['selected'] = True
-                self.refresh_search_data()
-                return
+        self.search_screen.set_selected(ingr_name, True)
 
     def deselect_ingr(self, ingr_name: str):
-        for index, item in enumerate(self.search_screen.data):
-            if item['ingr_name'] == ingr_name:
-                self.search_screen.data[index]['selected'] = False
-                self.refresh_search_data()
-                return
-
-    def search_recipes(self) -> dict:
-        """Return dict of recipes containing currently selected ingredients."""
-        ingr_included = [item['ingr_name']
-                         for item in self.search_screen.get_selected_ingredients()]
-        self.results_screen.data = [
-            {
-                'recipe_id': self.searcher.get_recipe_id(recipe.title, recipe.url),
-                'recipe_title': recipe.title,
-                'recipe_url': recipe.url,
-                'ingredients': recipe.ingredients_known
-            }
-            for recipe in self.searcher.get_recipes(ingr_included)
-        ]
-        self.refresh_search_data()
+        self.search_screen.set_selected(ingr_name, False)
+
+    def search_recipes(self):
+        """Show recipes containing currently selected ingredients."""
+        self._ingr_included = [item['ingr_name']
+                               for item
+                               in self.search_screen.get_selected_ingredients()]
+        self.show_results()
         self.transition.direction = 'left'
         self.manager.current = 'results_screen'
 
+    def show_results(self):
+        if self._ingr_included is None:
+            return
+        self.results_screen.show_results(self.searcher.get_results(
+            self._ingr_included, self.results_screen.order))
+
+    def sort_results(self, order_name: str):
+        if order_name != self.results_screen.order_name:
+            self.results_screen.order_name = order_name
+            self.show_results()
+
     def go_back_from_results(self):
         self.transition.direction = 'right'
         self.manager.current = 'search_screen'
@@ -285,5 +566,5 @@ class WtcApp(App):
         webbrowser.open(url)
 
 
-def start_app(loader: Loader, searcher: Searcher):
-    WtcApp(loader, searcher).run()
+def start_app(loader: Loader, searcher: Searcher, on_started=None):
+    WtcApp(loader, searcher, on_started).run()
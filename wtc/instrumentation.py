@@ -0,0 +1,140 @@
+"""
+Timers and counters for the hot paths, plus an optional cProfile run.
+Everything is off by default: a disabled timer costs a function call.
+
+Set WTC_INSTRUMENTATION to a JSON path to collect them while the app runs,
+and WTC_PROFILE to a path for the cProfile stats. Both are written at exit.
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+enabled = False
+
+# {name: [count, total_seconds, max_seconds]}
+_stats = {}
+_stats_lock = threading.Lock()
+_profiler = None
+_DISABLED = nullcontext()
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def record(name: str, seconds: float = 0.0, amount: int = 1):
+    """Add amount calls lasting seconds in total to name."""
+    with _stats_lock:
+        stat = _stats.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += amount
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+
+
+def count(name: str, amount: int = 1):
+    if enabled:
+        record(name, amount=amount)
+
+
+class _Timer:
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self._name, time.perf_counter() - self._start)
+
+
+def timer(*name_parts: str):
+    """
+    Return a context manager timing its block under the name joined from
+    name_parts with dots. They're only joined when enabled.
+    """
+    if not enabled:
+        return _DISABLED
+    return _Timer('.'.join(name_parts))
+
+
+def timed(name: str):
+    """Decorator timing every call to the function under name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stats() -> dict:
+    """
+    Return {name: {'count', 'total_seconds', 'mean_ms', 'max_ms'}} of the
+    timers and counters recorded so far.
+    """
+    with _stats_lock:
+        return {
+            name: {
+                'count': num_calls,
+                'total_seconds': total,
+                'mean_ms': total / num_calls * 1000 if num_calls else 0.0,
+                'max_ms': longest * 1000,
+            }
+            for name, (num_calls, total, longest) in sorted(_stats.items())
+        }
+
+
+def dump(path: str):
+    with open(path, 'w') as fp:
+        json.dump(stats(), fp, indent=2)
+    logging.info(f'Instrumentation written to {path}.')
+
+
+def start_profiling():
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop_profiling(path: str = None):
+    """Stop profiling, writing the stats to path if given."""
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.disable()
+    if path:
+        _profiler.dump_stats(path)
+        logging.info(f'Profile written to {path}.')
+    _profiler = None
+
+
+def configure_from_environment():
+    """Turn on what WTC_INSTRUMENTATION and WTC_PROFILE ask for."""
+    stats_path = os.environ.get('WTC_INSTRUMENTATION')
+    if stats_path:
+        enable()
+        atexit.register(dump, stats_path)
+    profile_path = os.environ.get('WTC_PROFILE')
+    if profile_path:
+        start_profiling()
+        atexit.register(stop_profiling, profile_path)
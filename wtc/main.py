@@ -1,19 +1,51 @@
 __author__ = "Federico Tambara"
 __license__ = "MIT"
 
-import gui
+import logging
+import time
+
+import db
+import instrumentation
 from processing import Loader, Searcher
 
 
+def _log_startup(start: float, laps: list[tuple[str, float]]):
+    """Log how long each startup phase took, from (phase, end time) laps."""
+    previous = start
+    report = []
+    for phase, end in laps:
+        report.append(f'{phase} {(end - previous) * 1000:.0f} ms')
+        previous = end
+    logging.info(f'Started in {(previous - start) * 1000:.0f} ms: '
+                 + ', '.join(report))
+
+
 def main():
     """ Main entry point of the app """
-    loader = Loader()
-    searcher = Searcher()
-    loader.store_ingredients() #TODO call through GUI when user requires.
-    gui.start_app(loader, searcher)
+    start = time.perf_counter()
+    laps = []
+    instrumentation.configure_from_environment()
+
+    interface = db.Interface()
+    loader = Loader(interface)
+    searcher = Searcher(interface)
+    laps.append(('database', time.perf_counter()))
+
+    # Ingredients are synced in the background while Kivy is imported.
+    ingredients_stored = interface.submit(
+        loader.store_ingredients)  # TODO call through GUI when user requires.
+    import gui
+    laps.append(('gui import', time.perf_counter()))
+    ingredients_stored.result()
+    laps.append(('ingredients', time.perf_counter()))
+
+    def started():
+        laps.append(('window', time.perf_counter()))
+        _log_startup(start, laps)
+
+    gui.start_app(loader, searcher, on_started=started)
 
 
 if __name__ == "__main__":
     """ This is executed when run from the command line """
     main()
-    
\ No newline at end of file
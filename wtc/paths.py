@@ -5,7 +5,12 @@ project_path = os.path.join(os.path.dirname(__file__), "../")
 # Modify these if needed
 ingredients_path = project_path + 'user_files/ingredients.txt'
 recipes_path = project_path + 'user_files/recipes.csv'
-database_path = project_path + 'assets/database/recipes.db'
+# Path or "file:" URI of the database, see db.Interface.
+database_path = os.environ.get('WTC_DATABASE',
+                               project_path + 'assets/database/recipes.db')
+
+if not database_path.startswith((':memory:', 'file:')):
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
 
 os.makedirs(os.path.dirname(ingredients_path), exist_ok=True)
 
@@ -1,24 +1,98 @@
 import re
 import csv
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
 import sqlite3
-from typing import Iterator
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Union
 
 import db
-from definitions import Ingredient, Recipe
-from paths import ingredients_path, recipes_path
+import instrumentation
+from definitions import Ingredient, Recipe, stem
+from paths import database_path, ingredients_path, recipes_path
 import logging
 
+# Number of recipes written to the database per transaction while loading.
+RECIPES_PER_TRANSACTION = 500
+# Number of CSV rows sent at once to each worker process while loading.
+RECIPES_PER_CHUNK = 200
 
-# TODO turn prints to logging
+# Number of recipes fetched at once when showing search results.
+RESULTS_PER_PAGE = 20
+# Orders search results can be sorted by.
+RECIPE_ORDERS = ('id', 'title', 'num_ingredients')
+# Number of searches whose results Searcher keeps.
+RESULT_CACHE_SIZE = 128
+# Most changed recipes Searcher applies to its indexes. Past this they are
+# rebuilt, which is about as fast.
+INDEX_UPDATE_MAX_RECIPES = 5000
 
-def _concatenate_window(list_str: str) -> Iterator[str]:
+# Ingredient names may only contain letters and spaces.
+_INVALID_INGREDIENT_CHAR = re.compile(r'[^\w ]|[\d_]')
+
+# Longest phrase, in words, indexed for each text pending review. Longer
+# ingredients are looked for by scanning all texts.
+UNKNOWN_PHRASE_WORDS = 4
+
+def _tokenize(line: str) -> list[str]:
+    """Split line into lowercase words, dropping punctuation."""
+    return [word for word in re.split(r'\W+', line.lower().strip()) if word]
+
+
+class IngrIndex:
     """
-    Return generetor of strings by parsing list_str through a window of
-    decreasing number of words, starting from all present down to one.
+    Lookup table of known ingredients, keyed by stem.
+    Build it once from the ingredient table and reuse it for every line to
+    parse, instead of comparing each phrase against the whole ingredient list.
     """
-    for words_at_a_time in range(len(list_str), 0, -1):
-        for index in range(len(list_str) - words_at_a_time + 1):
-            yield ' '.join(list_str[index:words_at_a_time+index])
+
+    def __init__(self, ingredients: Iterable[Ingredient] = ()) -> None:
+        self._by_stem = {}
+        # Word counts of the indexed ingredients, longest first. Only
+        # windows of these sizes can ever match.
+        self._word_counts = []
+        for ingr in ingredients:
+            self.add(ingr)
+
+    def add(self, ingr: Ingredient):
+        """Index ingr. If its stem is already present, keep the first one."""
+        self._by_stem.setdefault(ingr.stem, ingr)
+        num_words = len(ingr.name.split())
+        if num_words and num_words not in self._word_counts:
+            self._word_counts.append(num_words)
+            self._word_counts.sort(reverse=True)
+
+    @instrumentation.timed('extract_ingredient')
+    def find(self, line: str) -> Ingredient:
+        """
+        Return the indexed ingredient found in line, trying the ingredients
+        with the most words first, and the leftmost match among those.
+        Raise ValueError if no match.
+        """
+        words = _tokenize(line)
+        for num_words in self._word_counts:
+            for index in range(len(words) - num_words + 1):
+                phrase = ' '.join(words[index:index+num_words])
+                ingr = self._by_stem.get(stem(phrase))
+                if ingr is not None:
+                    return ingr
+
+        raise ValueError('line did not contain any known ingredient')
+
+    def __contains__(self, ingr: Ingredient) -> bool:
+        return ingr.stem in self._by_stem
+
+    def __len__(self) -> int:
+        return len(self._by_stem)
 
 
 class IngrParser:
@@ -27,52 +101,545 @@ class IngrParser:
     ingredient database
     """
 
-    def extract_ingredient(self, line: str, ingr_list: list[Ingredient]):
+    def extract_ingredient(self, line: str,
+                           ingredients: Union[IngrIndex, Iterable[Ingredient]]):
         """
         Extract the first ingredient found in line.
         Ingredients with more words have priority.
         For example if line = '100g of spring onion' would return
         'spring onion' (if present in ingredients database) instead of just
         'onion'.
+        ingredients can be a prebuilt IngrIndex, which should be preferred
+        when parsing many lines against the same ingredients.
         Return first found match. If no match, raise ValueError
         """
+        if not isinstance(ingredients, IngrIndex):
+            ingredients = IngrIndex(ingredients)
+        return ingredients.find(line)
 
-        # Tokenize line
-        word_list = re.split(r'\W+', line.lower().strip())
 
-        # Try to detect the ingredient with the most words first, so that
-        # "spring onion" has precedence over "onion"
-        for phrase in _concatenate_window(word_list):
-            possible_ingredient = Ingredient(phrase)
-            if possible_ingredient in ingr_list:
-                return possible_ingredient
+def _hash_row(row: list[str]) -> str:
+    """Return a digest of the contents of a CSV row."""
+    return hashlib.sha1('\x1f'.join(row).encode()).hexdigest()
 
-        raise ValueError('line did not contain any known ingredient')
 
-    def check_chars(self, line: str) -> list[str]:
+def _file_digest(path: str, size: int) -> str:
+    """Return a digest of the first size bytes of the file at path."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        while size > 0:
+            block = fp.read(min(size, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            size -= len(block)
+    return digest.hexdigest()
+
+
+def _ends_with_newline(path: str, size: int) -> bool:
+    """Return whether the first size bytes of the file at path end a line."""
+    if not size:
+        return True
+    with open(path, 'rb') as fp:
+        fp.seek(size - 1)
+        return fp.read(1) == b'\n'
+
+
+def _parse_recipe(row: list[str], ingr_index: IngrIndex) -> Recipe:
+    """
+    Build a recipe out of a CSV row, extracting its ingredients.
+    Return None if the row doesn't have a title and URL, or they're blank.
+    """
+    if len(row) < 2 or not row[0].strip() or not row[1].strip():
+        return None
+    title, url, *ingredients_raw = row
+
+    # Parse ingredient list, check if all are recognized.
+    known_ingredients = []
+    unknown_ingredients = []
+    for ingr_name in ingredients_raw:
+        try:
+            ingr = ingr_index.find(ingr_name)
+        except ValueError:
+            unknown_ingredients.append(ingr_name)
+        else:
+            known_ingredients.append(ingr)
+
+    return Recipe(title,
+                  url,
+                  ingredients_known=known_ingredients,
+                  ingredients_unknown=unknown_ingredients)
+
+
+# Ingredient index of each worker process, built once from the snapshot of
+# ingredient names the loader passes when starting the pool.
+_worker_ingr_index = None
+
+
+def _init_parse_worker(ingr_names: list[str]):
+    global _worker_ingr_index
+    _worker_ingr_index = IngrIndex(Ingredient(name) for name in ingr_names)
+
+
+def _parse_recipe_chunk(rows: list[list[str]]) -> list[tuple[str, Recipe]]:
+    return [(_hash_row(row), _parse_recipe(row, _worker_ingr_index))
+            for row in rows]
+
+
+def _parse_in_pool(rows: Iterator[list[str]],
+                   ingr_names: list[str],
+                   workers: int,
+                   chunk_size: int) -> Iterator[tuple[str, Recipe]]:
+    """
+    Parse rows in a pool of worker processes, yielding pairs of row hash and
+    recipe in file order.
+    Only a few chunks per worker are read ahead, so the file is streamed.
+    Workers are spawned, not forked: a fork could copy a lock, like the
+    stemmer's, held by another thread at that moment, and hang on it.
+    """
+    with ProcessPoolExecutor(workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_parse_worker,
+                             initargs=(ingr_names,)) as pool:
+        pending = deque()
+        try:
+            for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)),
+                              []):
+                pending.append(pool.submit(_parse_recipe_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Don't wait for chunks nobody will read when closed early.
+            for future in pending:
+                future.cancel()
+
+
+class IngrCompleter:
+    """
+    Type-ahead over ingredient names. A name matches a prefix when the name,
+    any of its words or its stem start with it, ignoring case.
+    """
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self._name_keys = {}
+        # Sorted (key, name) pairs, searched with bisect.
+        self._keys = []
+        self._names = []
+        # Last prefix completed and its result, narrowed while typing.
+        self._last = (None, [])
+        for name in names:
+            self._name_keys[name] = self._keys_of(name)
+        self._keys = sorted((key, name)
+                            for name, keys in self._name_keys.items()
+                            for key in keys)
+        self._names = sorted(self._name_keys)
+
+    @staticmethod
+    def _keys_of(name: str) -> frozenset[str]:
+        lower_name = name.lower().strip()
+        return frozenset([lower_name, stem(lower_name), *_tokenize(lower_name)])
+
+    def add(self, name: str):
+        if name in self._name_keys:
+            return
+        self._name_keys[name] = self._keys_of(name)
+        for key in self._name_keys[name]:
+            insort(self._keys, (key, name))
+        insort(self._names, name)
+        self._last = (None, [])
+
+    def __len__(self):
+        return len(self._names)
+
+    def complete(self, prefix: str) -> list[str]:
+        """
+        Return sorted names matching prefix, or all of them if it's blank.
+        When prefix extends the previous one, only the previous result is
+        filtered.
+        """
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return list(self._names)
+
+        last_prefix, last_result = self._last
+        if last_prefix and prefix.startswith(last_prefix):
+            result = [name for name in last_result
+                      if any(key.startswith(prefix)
+                             for key in self._name_keys[name])]
+        else:
+            start = bisect_left(self._keys, (prefix,))
+            end = bisect_left(self._keys, (prefix + '\uffff',), start)
+            result = sorted({name for _, name in self._keys[start:end]})
+        self._last = (prefix, result)
+        return result
+
+
+class RecipeIndex:
+    """
+    Inverted index from ingredient stems to the sorted ids of the recipes
+    containing them.
+    """
+
+    def __init__(self, recipe_stems: Iterable[tuple[int, str]]) -> None:
+        """
+        recipe_stems: (recipe_id, stem) pairs ordered by recipe_id. A None
+        stem indexes a recipe without ingredients.
+        """
+        self._postings = {}
+        self._stems = {}
+        for recipe_id, stem in recipe_stems:
+            stems = self._stems.setdefault(recipe_id, [])
+            if stem is not None:
+                stems.append(stem)
+                self._postings.setdefault(stem, array('q')).append(recipe_id)
+        self._recipe_ids = array('q', self._stems)
+
+    def update(self, recipe_ids: Iterable[int],
+               recipe_stems: Iterable[tuple[int, str]]):
+        """
+        Index recipe_ids again from recipe_stems, their current pairs as
+        taken by __init__. Those without pairs, deleted or with unknowns,
+        are removed.
+        """
+        for recipe_id in recipe_ids:
+            stems = self._stems.pop(recipe_id, None)
+            if stems is None:
+                continue
+            _remove_sorted(self._recipe_ids, recipe_id)
+            for stem in stems:
+                postings = self._postings[stem]
+                _remove_sorted(postings, recipe_id)
+                if not postings:
+                    del self._postings[stem]
+
+        for recipe_id, stem in recipe_stems:
+            if recipe_id not in self._stems:
+                self._stems[recipe_id] = []
+                insort(self._recipe_ids, recipe_id)
+            if stem is not None:
+                self._stems[recipe_id].append(stem)
+                insort(self._postings.setdefault(stem, array('q')),
+                       recipe_id)
+
+    def search(self, stems: Iterable[str]) -> list[int]:
+        """
+        Return sorted ids of the recipes containing all stems, or of every
+        recipe if stems is empty.
+        """
+        stems = set(stems)
+        if not stems:
+            return list(self._recipe_ids)
+
+        # Intersect starting from the shortest postings list.
+        postings = sorted((self._postings.get(stem, ()) for stem in stems),
+                          key=len)
+        result = set(postings[0])
+        for recipe_ids in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(recipe_ids)
+        return sorted(result)
+
+    def rank(self, stems: Iterable[str],
+             limit: int = None) -> list[tuple[int, float, int]]:
+        """
+        Return (recipe_id, coverage, num_missing) of the recipes containing
+        at least one of stems, where coverage is the fraction of the recipe
+        ingredients in stems. Best covered recipes come first, then those
+        missing fewer ingredients.
+        """
+        covered = Counter()
+        for stem in set(stems):
+            covered.update(self._postings.get(stem, ()))
+
+        ranking = []
+        for recipe_id, num_covered in covered.items():
+            num_ingredients = len(self._stems[recipe_id])
+            ranking.append((recipe_id,
+                            num_covered / num_ingredients,
+                            num_ingredients - num_covered))
+        ranking.sort(key=lambda item: (-item[1], item[2], item[0]))
+        return ranking[:limit]
+
+    def __len__(self) -> int:
+        return len(self._recipe_ids)
+
+
+def _remove_sorted(values: array, value: int):
+    """Remove value, which must be present, from the sorted array values."""
+    del values[bisect_left(values, value)]
+
+
+def _bitset(positions: list[int], size: int) -> int:
+    """Return int with the bits at positions set, all below size."""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class PantryIndex:
+    """
+    Recipes containing each stem as a bitset over recipe positions, to
+    match all recipes against a pantry with a few integer operations per
+    stem.
+    """
+
+    def __init__(self, recipe_stems: Iterable[tuple[int, str]]) -> None:
+        """
+        recipe_stems: (recipe_id, stem) pairs, as taken by RecipeIndex.
+        """
+        # Positions stay assigned to recipes removed by update, so those
+        # coming back take the same bit.
+        self._positions = {}
+        self._stems = {}
+        stem_positions = {}
+        for recipe_id, stem in recipe_stems:
+            position = self._positions.setdefault(recipe_id,
+                                                  len(self._positions))
+            stems = self._stems.setdefault(recipe_id, [])
+            if stem is not None:
+                stems.append(stem)
+                stem_positions.setdefault(stem, []).append(position)
+        self._recipe_ids = list(self._positions)
+        # Bitset of the recipes indexed.
+        self._all = (1 << len(self._positions)) - 1
+        # Each bitset is built once, OR-ing bits into an int would copy it
+        # for every recipe.
+        self._stem_recipes = {stem: _bitset(found, len(self._positions))
+                              for stem, found in stem_positions.items()}
+
+    def update(self, recipe_ids: Iterable[int],
+               recipe_stems: Iterable[tuple[int, str]]):
+        """See RecipeIndex.update."""
+        for recipe_id in recipe_ids:
+            stems = self._stems.pop(recipe_id, None)
+            if stems is None:
+                continue
+            keep = ~(1 << self._positions[recipe_id])
+            self._all &= keep
+            for stem in stems:
+                recipes = self._stem_recipes[stem] & keep
+                if recipes:
+                    self._stem_recipes[stem] = recipes
+                else:
+                    del self._stem_recipes[stem]
+
+        for recipe_id, stem in recipe_stems:
+            position = self._positions.setdefault(recipe_id,
+                                                  len(self._recipe_ids))
+            if position == len(self._recipe_ids):
+                self._recipe_ids.append(recipe_id)
+            bit = 1 << position
+            if recipe_id not in self._stems:
+                self._stems[recipe_id] = []
+                self._all |= bit
+            if stem is not None:
+                self._stems[recipe_id].append(stem)
+                self._stem_recipes[stem] = \
+                    self._stem_recipes.get(stem, 0) | bit
+
+    def _ids(self, recipes: int) -> list[int]:
+        """Return sorted ids of the recipes in bitset recipes."""
+        digits = bin(recipes)[:1:-1]
+        ids = []
+        position = digits.find('1')
+        while position != -1:
+            ids.append(self._recipe_ids[position])
+            position = digits.find('1', position + 1)
+        # Recipes added by update may be out of order.
+        ids.sort()
+        return ids
+
+    def cookable(self, pantry: Iterable[str],
+                 max_missing: int = 0) -> list[tuple[int, int]]:
+        """
+        Return (recipe_id, num_missing) of the recipes having at most
+        max_missing ingredients out of pantry, fewest missing first.
+        With max_missing = 0, those whose ingredients are a subset of pantry.
+        """
+        pantry = set(pantry)
+        # missing[n]: recipes lacking at least n + 1 stems of pantry.
+        missing = [0] * (max_missing + 1)
+        for stem, recipes in self._stem_recipes.items():
+            if stem in pantry:
+                continue
+            for num in range(max_missing, 0, -1):
+                missing[num] |= missing[num - 1] & recipes
+            missing[0] |= recipes
+        result = []
+        lacking_fewer = self._all
+        for num in range(max_missing + 1):
+            result.extend((recipe_id, num) for recipe_id in
+                          self._ids(lacking_fewer & ~missing[num]))
+            lacking_fewer = missing[num]
+        return result
+
+    def containing(self, stems: Iterable[str]) -> list[int]:
+        """Return ids of the recipes whose ingredients include all stems."""
+        recipes = self._all
+        for stem in set(stems):
+            recipes &= self._stem_recipes.get(stem, 0)
+        return self._ids(recipes)
+
+    def __len__(self) -> int:
+        return len(self._stems)
+
+
+class UnknownIndex:
+    """
+    Index of the texts pending review by the stems of the phrases they
+    contain, to find directly which ones an extracted ingredient solves.
+    """
+
+    def __init__(self, unknowns: Iterable[tuple] = ()) -> None:
+        """
+        unknowns: (recipe_id, recipe_title, recipe_url, text_with_unknown)
+        tuples, as returned by db.Interface.get_unknowns.
+        """
+        self._by_phrase = {}
+        self._recipes_by_text = {}
+        self._recipe_info = {}
+        for recipe_id, title, url, text in unknowns:
+            self.add(recipe_id, title, url, text)
+
+    @staticmethod
+    def _phrase_keys(text: str) -> Iterator[tuple[int, str]]:
+        """Yield (number of words, stem) of each phrase in text."""
+        words = _tokenize(text)
+        for num_words in range(1, min(len(words), UNKNOWN_PHRASE_WORDS) + 1):
+            for index in range(len(words) - num_words + 1):
+                yield num_words, stem(' '.join(words[index:index+num_words]))
+
+    def add(self, recipe_id: int, title: str, url: str, text: str):
+        self._recipe_info[recipe_id] = (title, url)
+        self._recipes_by_text.setdefault(text, set()).add(recipe_id)
+        for key in self._phrase_keys(text):
+            self._by_phrase.setdefault(key, set()).add((recipe_id, text))
+
+    def remove(self, text: str, recipe_id: int = None):
+        """Remove text from recipe_id, or from all recipes if None."""
+        recipe_ids = self._recipes_by_text.get(text, set())
+        to_remove = recipe_ids if recipe_id is None else {recipe_id}
+        to_remove = to_remove & recipe_ids
+        if not to_remove:
+            return
+        for key in set(self._phrase_keys(text)):
+            entries = self._by_phrase[key]
+            entries.difference_update((id, text) for id in to_remove)
+            if not entries:
+                del self._by_phrase[key]
+        recipe_ids -= to_remove
+        if not recipe_ids:
+            del self._recipes_by_text[text]
+
+    def find(self, ingr: Ingredient) -> dict:
+        """
+        Return texts solved by ingr as a dictionary:
+            {id: (recipe_title, recipe_url, unknowns_list)}
+        """
+        num_words = len(ingr.name.split())
+        if num_words <= UNKNOWN_PHRASE_WORDS:
+            matches = self._by_phrase.get((num_words, ingr.stem), ())
+        else:
+            ingr_index = IngrIndex([ingr])
+            matches = []
+            for text, recipe_ids in self._recipes_by_text.items():
+                try:
+                    ingr_index.find(text)
+                except ValueError:
+                    continue
+                matches.extend((id, text) for id in recipe_ids)
+
+        candidates = {}
+        for recipe_id, text in sorted(matches):
+            candidates.setdefault(
+                recipe_id, (*self._recipe_info[recipe_id], []))[-1]\
+                .append(text)
+        return candidates
+
+
+class RecipeResults:
+    """
+    Ids of the recipes found by a search, whose recipes are fetched from the
+    database a page at a time, when first asked for.
+    """
+
+    def __init__(self, interface: db.Interface, recipe_ids: list[int],
+                 page_size: int = RESULTS_PER_PAGE) -> None:
+        self._interface = interface
+        self.recipe_ids = recipe_ids
+        self.page_size = page_size
+        self._pages = {}
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    @property
+    def num_pages(self) -> int:
+        return -(-len(self.recipe_ids) // self.page_size)
+
+    def page(self, number: int) -> list[Recipe]:
         """
-        Validate line caracters to see if they are allowed.
-        Return list of bools with validation result per character.
+        Return the recipes in page number, counting from 0. Recipes deleted
+        since the search are skipped.
         """
-        return [char.isalpha() or char == ' ' for char in line]
+        if number not in self._pages:
+            start = number * self.page_size
+            self._pages[number] = self._interface.get_recipes_by_id(
+                self.recipe_ids[start:start+self.page_size])
+        return self._pages[number]
+
+    def __iter__(self) -> Iterator[Recipe]:
+        for number in range(self.num_pages):
+            yield from self.page(number)
 
 
 class RecipeLog:
-    """Track the status of recipes at loading time."""
+    """
+    Track the status of recipes at loading time, and how long each stage of
+    the loading took. Counts and stage times also go to instrumentation.
+    """
 
     def __init__(self):
+        self._num_read = 0
         self._num_successful = 0
         self._num_with_unknowns = 0
         self._num_errors = 0
+        self._start_time = time.perf_counter()
+        self._stage_seconds = Counter()
+
+    def reading(self, rows: Iterable) -> Iterator:
+        """Yield rows, counting them as read."""
+        for row in rows:
+            self._num_read += 1
+            yield row
 
     def count_success(self):
         self._num_successful += 1
+        instrumentation.count('load.loaded')
 
     def count_error(self):
         self._num_errors += 1
+        instrumentation.count('load.errors')
 
     def count_with_unknowns(self):
         self._num_with_unknowns += 1
+        instrumentation.count('load.with_unknowns')
+
+    @contextmanager
+    def stage(self, name: str):
+        """Add the time spent in the block to stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._stage_seconds[name] += seconds
+            if instrumentation.enabled:
+                instrumentation.record(f'load.{name}', seconds)
 
     def get_counters(self) -> tuple[int, int, int]:
         """Return number of successes, unknowns, and errors"""
@@ -80,6 +647,22 @@ class RecipeLog:
                 self._num_with_unknowns,
                 self._num_errors)
 
+    def get_progress(self) -> dict:
+        """
+        Return counters so far, seconds since loading started, rows read
+        per second and seconds spent in each stage.
+        """
+        elapsed = time.perf_counter() - self._start_time
+        return {
+            'rows_read': self._num_read,
+            'loaded': self._num_successful,
+            'with_unknowns': self._num_with_unknowns,
+            'errors': self._num_errors,
+            'seconds': elapsed,
+            'rows_per_second': self._num_read / elapsed if elapsed else 0.0,
+            'stage_seconds': dict(self._stage_seconds),
+        }
+
 
 class Loader:
     """
@@ -87,12 +670,22 @@ class Loader:
     """
     # TODO recipe update and deletion features
 
-    def __init__(self):
+    def __init__(self, interface: db.Interface = None,
+                 database: str = database_path):
+        """
+        interface: connection to the database, shared with a Searcher if
+        given. Otherwise a new one is opened to database, a path or URI.
+        See db.Interface.
+        """
 
         self.ingredients_file_path = ingredients_path
         self.recipes_file_path = recipes_path
-        self._interface = db.Interface()
+        self._interface = interface or db.Interface(database)
         self._parser = IngrParser()
+        # Built on first use, then kept in step with the unknowns table as
+        # changes are committed. Loading updates it from its own thread.
+        self._unknown_index = None
+        self._unknown_index_lock = threading.RLock()
 
     def set_ingr_path(self, path):
         self.ingredients_file_path = path
@@ -100,66 +693,213 @@ class Loader:
     def set_recipes_path(self, path):
         self.recipes_file_path = path
 
-    def load_recipes(self):
+    def load_recipes(self,
+                     batch_size: int = RECIPES_PER_TRANSACTION,
+                     workers: int = 1,
+                     chunk_size: int = RECIPES_PER_CHUNK,
+                     incremental: bool = True,
+                     progress: Callable[[dict], None] = None,
+                     cancel: threading.Event = None):
         """
         Read the CSV file from RECIPES_TO_PROCESS_FILE_LOC
         and call the Parser to extract the ingredients out of each entry.
         Store on the database those recipes for which the parser detected one
         ingredient for every line.
 
+        The file is streamed. With more than one worker, ingredients are
+        extracted by that many processes, chunk_size rows at a time, against
+        a snapshot of the stored ingredients. Recipes are written from this
+        process in transactions of up to batch_size recipes.
+
+        If incremental, the file is skipped when unchanged since the last
+        load, only its new part is read when it was appended to, and only
+        rows that changed since they were loaded are parsed. A changed row
+        replaces the recipe with the same title or URL.
+
+        progress is called after each transaction with the counters of
+        RecipeLog.get_progress. It runs in the loading thread.
+        Loading stops after the current transaction once cancel is set. The
+        recipes stored so far are kept, and the next load goes on from them.
+
         Return tuple of ints (num_loaded, num_with_unknowns, num_errors)
         """
 
         logging.info('Loading recipes')
 
         recipe_log = RecipeLog()
+        path = os.path.abspath(self.recipes_file_path)
+        file_stat = os.stat(path)
 
-        for title, url, *ingredients_raw in self._read_recipe_line(self.recipes_file_path):
+        offset = 0
+        last_load = self._interface.get_loaded_file(path)
+        if incremental and last_load:
+            mtime_ns, size, digest = last_load
+            if (mtime_ns, size) == (file_stat.st_mtime_ns, file_stat.st_size):
+                logging.info('Recipes file unchanged since last load.')
+                return recipe_log.get_counters()
+            # New text after a last row without a newline would continue
+            # that row, so the file is read again.
+            if (file_stat.st_size >= size
+                    and _ends_with_newline(path, size)
+                    and _file_digest(path, size) == digest):
+                logging.info('Recipes file was appended to, reading new '
+                             'rows only.')
+                offset = size
 
-            # Parse ingredient list, check if all are recognized.
-            known_ingredients = []
-            unknown_ingredients = []
-            for ingr_name in ingredients_raw:
-                try:
-                    ingr = self._parser.extract_ingredient(
-                        ingr_name, self._interface.get_ingredients())
-                except ValueError:
-                    unknown_ingredients.append(ingr_name)
-                else:
-                    known_ingredients.append(ingr)
+        rows = recipe_log.reading(self._read_recipe_line(path, offset))
+        if incremental:
+            loaded_hashes = self._interface.get_row_hashes()
+            rows = (row for row in rows if _hash_row(row) not in loaded_hashes)
 
-                recipe = Recipe(title,
-                                url,
-                                ingredients_known=known_ingredients,
-                                ingredients_unknown=unknown_ingredients)
+        ingredients = self._interface.get_ingredients()
+        if workers > 1:
+            recipes = _parse_in_pool(rows,
+                                     [ingr.name for ingr in ingredients],
+                                     workers,
+                                     chunk_size)
+        else:
+            ingr_index = IngrIndex(ingredients)
+            recipes = ((_hash_row(row), _parse_recipe(row, ingr_index))
+                       for row in rows)
 
-            try:
-                self._interface.store_recipe(recipe)
+        # Recipes stored or replaced by this load, so later rows with the
+        # same title or URL are duplicates.
+        loaded_ids = set()
+        file_hashes = None
 
-            except ValueError:
-                logging.info('Recipe ignored, title or URL already '
-                             'present.')
-                # No counters for duplicated recipes.
-            else:
-                if not unknown_ingredients:
-                    logging.info('Recipe loaded successfully.')
-                    recipe_log.count_success()
-                else:
-                    logging.warning('Recipe loaded with some ingredients not '
-                                    'recognized:')
-                    print(f'{unknown_ingredients}')
-                    recipe_log.count_with_unknowns()
+        def row_in_file(row_hash: str) -> bool:
+            nonlocal file_hashes
+            if file_hashes is None:
+                file_hashes = {_hash_row(row)
+                               for row in self._read_recipe_line(path)}
+            return row_hash in file_hashes
+
+        while True:
+            with recipe_log.stage('parse'):
+                batch = list(itertools.islice(recipes, batch_size))
+            if not batch:
+                break
+            stored = []
+            with recipe_log.stage('store'), self._interface.transaction():
+                for row_hash, recipe in batch:
+                    self._store_loaded_recipe(recipe, row_hash, recipe_log,
+                                              loaded_ids, row_in_file, stored)
+            self._index_stored_unknowns(stored)
+            if progress is not None:
+                progress(recipe_log.get_progress())
+            if cancel is not None and cancel.is_set():
+                recipes.close()
+                logging.info('Loading recipes cancelled.')
+                return recipe_log.get_counters()
+
+        self._interface.set_loaded_file(path,
+                                        file_stat.st_mtime_ns,
+                                        file_stat.st_size,
+                                        _file_digest(path, file_stat.st_size))
 
         logging.info('Recipes EOF')
         num_new_ok, num_with_unknowns, num_errors = recipe_log.get_counters()
+        progress = recipe_log.get_progress()
         logging.info(
             f'Loaded {num_new_ok} new recipes. '
-            + f'{num_with_unknowns} had unknown ingredients.')
+            + f'{num_with_unknowns} had unknown ingredients. '
+            + f'Read {progress["rows_read"]} rows in '
+            + f'{progress["seconds"]:.2f} s '
+            + f'({progress["rows_per_second"]:.0f} rows/s).')
         if num_errors:
             logging.error(
                 f'{num_errors} recipes had errors while loading recipes.')
         return recipe_log.get_counters()
 
+    def _store_loaded_recipe(self, recipe: Recipe, row_hash: str,
+                             recipe_log: RecipeLog,
+                             loaded_ids: set[int],
+                             row_in_file: Callable[[str], bool],
+                             stored: list[tuple[int, Recipe, bool]]):
+        """
+        Store a recipe read from file and count it in recipe_log.
+        A recipe with the same title or URL is only replaced when the row it
+        was loaded from is no longer in the file, meaning the row changed.
+        Otherwise, or if it was stored earlier in this load (loaded_ids),
+        the row is a duplicate and is ignored.
+        Append (recipe_id, recipe, replaced) to stored, for
+        _index_stored_unknowns once the transaction is committed.
+        """
+        if recipe is None:
+            logging.error('Recipe ignored, title or URL missing.')
+            recipe_log.count_error()
+            return
+        try:
+            recipe_id = self._interface.store_recipe(recipe)
+
+        except ValueError:
+            recipe_id = self._interface.find_recipe_id(recipe.title,
+                                                       recipe.url)
+            old_hash = self._interface.get_row_hash(recipe_id)
+            if old_hash is None:
+                # Loaded before rows were hashed, keep what was reviewed.
+                self._interface.set_row_hash(recipe_id, row_hash)
+                loaded_ids.add(recipe_id)
+            if (old_hash is None
+                    or recipe_id in loaded_ids
+                    or row_in_file(old_hash)):
+                logging.info('Recipe ignored, title or URL already '
+                             'present.')
+                # No counters for duplicated recipes.
+                return
+            try:
+                self._interface.replace_recipe(recipe_id, recipe)
+            except ValueError:
+                logging.error('Recipe ignored, title and URL belong to '
+                              'different recipes.')
+                recipe_log.count_error()
+                return
+            logging.info('Recipe changed in file, updated.')
+            replaced = True
+        else:
+            replaced = False
+
+        self._interface.set_row_hash(recipe_id, row_hash)
+        loaded_ids.add(recipe_id)
+        stored.append((recipe_id, recipe, replaced))
+        if not recipe.has_unknowns():
+            logging.info('Recipe loaded successfully.')
+            recipe_log.count_success()
+        else:
+            logging.warning('Recipe loaded with some ingredients not '
+                            f'recognized: {list(recipe.ingredients_unknown)}')
+            recipe_log.count_with_unknowns()
+
+    def _update_unknown_index(self, update: Callable[[UnknownIndex], None]):
+        """
+        Call update with the unknown index, if built, after changes to the
+        unknowns are committed. Inside a transaction of the caller, which
+        may still be rolled back, the index is dropped instead.
+        """
+        with self._unknown_index_lock:
+            if self._unknown_index is None:
+                return
+            if self._interface.in_transaction:
+                self._unknown_index = None
+                return
+            update(self._unknown_index)
+
+    def _index_stored_unknowns(self, stored: list[tuple[int, Recipe, bool]]):
+        """
+        Add the unknowns of committed recipes to the unknown index. Replaced
+        recipes drop it, as their old unknowns are gone.
+        An index built after the commit has them already, adding is harmless.
+        """
+        if any(replaced for *_, replaced in stored):
+            with self._unknown_index_lock:
+                self._unknown_index = None
+
+        def update(index: UnknownIndex):
+            for recipe_id, recipe, _ in stored:
+                for text in recipe.ingredients_unknown:
+                    index.add(recipe_id, recipe.title, recipe.url, text)
+        self._update_unknown_index(update)
+
     @property
     def num_new_recipes(self):
         raise NotImplementedError
@@ -170,6 +910,27 @@ class Loader:
 
     def delete_recipe(self, recipe_id):
         self._interface.delete_recipe(recipe_id)
+        with self._unknown_index_lock:
+            self._unknown_index = None
+
+    @property
+    def unknown_index(self) -> UnknownIndex:
+        """
+        Index of the unknowns. Only use it holding _unknown_index_lock, as
+        loading updates it from another thread.
+        """
+        with self._unknown_index_lock:
+            if self._unknown_index is None:
+                self._unknown_index = UnknownIndex(
+                    self._interface.get_unknowns())
+            return self._unknown_index
+
+    def _remove_unknowns(self, unknowns: list[tuple[str, int]]):
+        """Remove (text, recipe_id) unknowns from the index."""
+        def update(index: UnknownIndex):
+            for text, recipe_id in unknowns:
+                index.remove(text, recipe_id)
+        self._update_unknown_index(update)
 
     def get_pending_review(self) -> dict:
         """
@@ -202,50 +963,60 @@ class Loader:
         self._parser.extract_ingredient(
             text_with_unknown, [extracted_ingr])
 
-        # If everything is ok, solve the unknown in the database
-        try:
-            self._interface.store_ingredient(extracted_ingr)
-        except ValueError:
-            logging.info(
-                f'Ingredient "{extracted_ingr.name}" already present.')
-            pass
-        self._interface.solve_unknown(
-            recipe_id, text_with_unknown, extracted_ingr)
-        for id, (*_, unknowns) in self.get_solution_candidates(extracted_ingr).items():
-            for unknown in unknowns:
-                try: 
-                    self._interface.solve_unknown(
-                    id, unknown, extracted_ingr)
-                except sqlite3.IntegrityError:
-                    # This error indicates that there was likely an error on
-                    # candidate recognition. TODO: take note of unkowns
-                    # involved and present them to the user for manual review.
-                    logging.warning('Problem with automatic solving. '\
-                        'Duplicate ingredient loading was attempted for this '\
-                        'recipe.')
+        # If everything is ok, solve the unknown in the database, along with
+        # all the others the same ingredient solves. The index is updated
+        # once they are committed.
+        solved = [(text_with_unknown, recipe_id)]
+        with self._interface.transaction():
+            try:
+                self._interface.store_ingredient(extracted_ingr)
+            except ValueError:
+                logging.info(
+                    f'Ingredient "{extracted_ingr.name}" already present.')
+                pass
+            self._interface.solve_unknown(
+                recipe_id, text_with_unknown, extracted_ingr)
+            candidates = self.get_solution_candidates(extracted_ingr)
+            for id, (*_, unknowns) in candidates.items():
+                for unknown in unknowns:
+                    if (unknown, id) in solved:
+                        continue
+                    try:
+                        self._interface.solve_unknown(
+                            id, unknown, extracted_ingr)
+                    except sqlite3.IntegrityError:
+                        # This error indicates that there was likely an error
+                        # on candidate recognition. TODO: take note of
+                        # unkowns involved and present them to the user for
+                        # manual review.
+                        logging.warning('Problem with automatic solving. '\
+                            'Duplicate ingredient loading was attempted for '\
+                            'this recipe.')
+                    solved.append((unknown, id))
+        self._remove_unknowns(solved)
 
     def delete_unknown(self, text_with_unknown):
         self._interface.delete_unknown(text_with_unknown)
+        self._update_unknown_index(
+            lambda index: index.remove(text_with_unknown))
 
+    @instrumentation.timed('solution_candidates')
     def get_solution_candidates(self, extracted_ingr: Ingredient):
+        """
+        Return unknowns solved by extracted_ingr as a dictionary:
+            {id: (recipe_title, recipe_url, unknowns_list)}
+        """
+        with self._unknown_index_lock:
+            return self.unknown_index.find(extracted_ingr)
 
-        candidates = {}
-        # Check if other unknowns are solved with the same ingredient
-        for id, (title, url, unknowns) in self.get_pending_review().items():
-            for unknown in unknowns:
-                try:
-                    self._parser.extract_ingredient(
-                        unknown, [extracted_ingr])
-                except ValueError:
-                    pass
-                else:
-                    candidates.setdefault(id, (title, url, []))[-1]\
-                        .append(unknown)
-        return candidates
-
-    def _read_recipe_line(self, recipes_file):
-        """Read recipes file and yield lines that aren't comments."""
-        with open(recipes_file) as fp:
+    def _read_recipe_line(self, recipes_file, offset: int = 0):
+        """
+        Read recipes file, starting offset bytes into it, and yield lines
+        that aren't comments.
+        """
+        with open(recipes_file, 'rb') as raw:
+            raw.seek(offset)
+            fp = io.TextIOWrapper(raw, newline='')
             csv_reader = csv.reader(fp, dialect='unix')
             for line in csv_reader:
                 if not line or line[0].strip("' ").startswith('#'):
@@ -260,59 +1031,275 @@ class Loader:
                 if line != '\n':
                     yield line
 
-    def store_ingredients(self):
+    def store_ingredients(self, incremental: bool = True) -> dict:
         """
-        Load ingredients from ingr_list into database.
-        Those already present are ignored.
+        Load ingredients from ingr_list into database, all at once.
+        Ingredients are told apart by stem: lines matching a stored
+        ingredient, or an earlier line, are skipped. So are lines with
+        characters other than letters and spaces.
+        If incremental, the file is skipped when unchanged since the last
+        time it was stored.
+
+        Return report of the lines {'added', 'present', 'duplicated',
+        'invalid'}, each a list of ingredient names.
         """
 
-        print('Loading ingredients:')
+        report = {'added': [], 'present': [], 'duplicated': [], 'invalid': []}
+        path = os.path.abspath(self.ingredients_file_path)
+        file_stat = os.stat(path)
+        last_load = self._interface.get_loaded_file(path)
+        if (incremental and last_load
+                and last_load[:2] == (file_stat.st_mtime_ns,
+                                      file_stat.st_size)):
+            logging.info('Ingredients file unchanged since last load.')
+            return report
+
+        logging.info('Loading ingredients.')
 
         # Get new ingredients
+        known = self._interface.get_ingredient_stems()
+        known_stems = set(known.values())
+        new_stems = set()
         to_add = []
         for line in self._read_ingredient_line():
-            line = line.strip().lower()
-            # Skip if the line represents an ingredient already present
-            if Ingredient(line) in self._interface.get_ingredients():
+            name = line.strip().lower()
+            if not name:
                 continue
-            char_checklist = self._parser.check_chars(line)
-            if all(char_checklist):
-                to_add.append(line)
+            # Stored names are skipped without stemming them.
+            if name in known:
+                report['present'].append(name)
+                continue
+            invalid_char = _INVALID_INGREDIENT_CHAR.search(name)
+            if invalid_char:
+                logging.warning(f'"{name}" contains invalid characters '
+                                f'({invalid_char.group()})')
+                report['invalid'].append(name)
+                continue
+            ingr = Ingredient(name)
+            if ingr.stem in known_stems:
+                report['present'].append(name)
+            elif ingr.stem in new_stems:
+                report['duplicated'].append(name)
             else:
-                logging.warning(f'"{line}" contains invalid characters '
-                                f'({line[char_checklist.index(False)]})')
+                new_stems.add(ingr.stem)
+                to_add.append(ingr)
 
         # TODO ask confirmation through GUI
         if not to_add:
-            logging.info('No new ingredients to add.\n')
+            logging.info('No new ingredients to add.')
         else:
-            logging.info("Ingredients to add:")
-            for ingr in to_add:
-                self._interface.store_ingredient(Ingredient(ingr))
-            print(
+            self._interface.store_ingredients(to_add)
+            report['added'] = [ingr.name for ingr in to_add]
+            logging.info(
                 f'{len(to_add)} ingredient'
                 f'{"s" if len(to_add) != 1 else ""} added.')
+        if report['duplicated'] or report['invalid']:
+            logging.warning(f'{len(report["duplicated"])} duplicated and '
+                            f'{len(report["invalid"])} invalid ingredients '
+                            'skipped.')
+
+        self._interface.set_loaded_file(path,
+                                        file_stat.st_mtime_ns,
+                                        file_stat.st_size,
+                                        _file_digest(path, file_stat.st_size))
+        return report
 
 
 class Searcher:
-    def __init__(self) -> None:
+    def __init__(self, interface: db.Interface = None,
+                 database: str = database_path) -> None:
+        """See Loader.__init__."""
 
-        self._interface = db.Interface()
+        self._interface = interface or db.Interface(database)
         self.parser = IngrParser()
+        self._recipe_index = None
+        self._pantry_index = None
+        # Position of each recipe id in each order, by order.
+        self._order_positions = {}
+        self._indexed_generation = None
+        # Least recently used first. Emptied when the database generation
+        # changes.
+        self._results = OrderedDict()
+        self._results_generation = None
+        self._cache_hits = 0
+        self._cache_misses = 0
 
     def get_recipes(self, ingr_included: list[str] = []) -> list[Recipe]:
         """
         Return all recipes stored in the database that contain
         ingr_included. If ingr_included is [], get all recipes in the database.
+        Recipes with unknown ingredients are omitted.
+        """
+        stems = frozenset(Ingredient(ingr).stem for ingr in ingr_included)
+        return list(self._cached(
+            ('recipes', stems),
+            lambda: self._interface.get_recipes_by_id(
+                self._search_recipe_ids(stems, 'id'))))
+
+    @instrumentation.timed('search')
+    def search_recipe_ids(self, ingr_included: list[str] = [],
+                          order: str = 'id') -> list[int]:
+        """
+        Return ids of the recipes get_recipes would return, sorted by one of
+        RECIPE_ORDERS.
         """
-        filter = [Ingredient(ingr) for ingr in ingr_included]
-        return self._interface.get_recipes(filter)
+        stems = frozenset(Ingredient(ingr).stem for ingr in ingr_included)
+        return list(self._cached(('ids', stems, order),
+                                 lambda: self._search_recipe_ids(stems, order)))
+
+    def _search_recipe_ids(self, stems: frozenset[str],
+                           order: str) -> list[int]:
+        recipe_ids = self.recipe_index.search(stems)
+        if order == 'id':
+            return recipe_ids
+        positions = self._get_order_positions(order)
+        # Recipes deleted meanwhile go last, they're skipped when fetched.
+        return sorted(recipe_ids,
+                      key=lambda id: positions.get(id, len(positions)))
+
+    def _cached(self, key: tuple, search: Callable[[], list]) -> list:
+        """
+        Return the result cached under key, or the one of search, which is
+        then cached. Only RESULT_CACHE_SIZE results are kept.
+        """
+        generation = self._interface.generation
+        if generation != self._results_generation:
+            self._results.clear()
+            self._results_generation = generation
+
+        try:
+            result = self._results[key]
+        except KeyError:
+            self._cache_misses += 1
+            instrumentation.count('search_cache.miss')
+            result = self._results[key] = search()
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        else:
+            self._cache_hits += 1
+            instrumentation.count('search_cache.hit')
+            self._results.move_to_end(key)
+        return result
+
+    def cache_info(self) -> dict:
+        """Return hits, misses, hit rate and size of the result cache."""
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            'hits': self._cache_hits,
+            'misses': self._cache_misses,
+            'hit_rate': self._cache_hits / lookups if lookups else 0.0,
+            'size': len(self._results),
+            'max_size': RESULT_CACHE_SIZE,
+        }
+
+    def get_results(self, ingr_included: list[str] = [],
+                    order: str = 'id',
+                    page_size: int = RESULTS_PER_PAGE) -> RecipeResults:
+        """
+        Like get_recipes, but only ids are searched now: recipes are
+        fetched a page at a time from the returned RecipeResults.
+        """
+        return RecipeResults(self._interface,
+                             self.search_recipe_ids(ingr_included, order),
+                             page_size)
+
+    def _get_order_positions(self, order: str) -> dict[int, int]:
+        if order not in RECIPE_ORDERS:
+            raise ValueError(f'Unknown recipe order {order!r}')
+        self._check_indexes()
+        if order not in self._order_positions:
+            self._order_positions[order] = {
+                recipe_id: position
+                for position, recipe_id
+                in enumerate(self._interface.get_ordered_recipe_ids(order))}
+        return self._order_positions[order]
+
+    def rank_recipes(self, ingr_available: list[str],
+                     limit: int = None) -> list[tuple[Recipe, float, int]]:
+        """
+        Return (recipe, coverage, num_missing) of the recipes containing any
+        of ingr_available, best covered first. See RecipeIndex.rank.
+        """
+        ranking = self.recipe_index.rank(
+            (Ingredient(ingr).stem for ingr in ingr_available), limit)
+        recipes = {recipe.recipe_id: recipe
+                   for recipe in self._interface.get_recipes_by_id(
+                       [recipe_id for recipe_id, *_ in ranking])}
+        return [(recipes[recipe_id], coverage, num_missing)
+                for recipe_id, coverage, num_missing in ranking
+                if recipe_id in recipes]
+
+    def get_cookable(self, ingr_available: list[str],
+                     max_missing: int = 0) -> list[tuple[Recipe, int]]:
+        """
+        Return (recipe, num_missing) of the recipes that can be cooked with
+        ingr_available, lacking at most max_missing ingredients.
+        Fewest missing first.
+        """
+        cookable = self.pantry_index.cookable(
+            (Ingredient(ingr).stem for ingr in ingr_available), max_missing)
+        recipes = {recipe.recipe_id: recipe
+                   for recipe in self._interface.get_recipes_by_id(
+                       [recipe_id for recipe_id, _ in cookable])}
+        return [(recipes[recipe_id], num_missing)
+                for recipe_id, num_missing in cookable
+                if recipe_id in recipes]
+
+    @property
+    def recipe_index(self) -> RecipeIndex:
+        """Index of recipes by ingredient, kept in step with the database."""
+        self._check_indexes()
+        if self._recipe_index is None:
+            self._recipe_index = RecipeIndex(
+                self._interface.get_recipe_stems())
+        return self._recipe_index
+
+    @property
+    def pantry_index(self) -> PantryIndex:
+        """
+        Recipe bitsets of the stored ingredients, kept in step with the
+        database.
+        """
+        self._check_indexes()
+        if self._pantry_index is None:
+            self._pantry_index = PantryIndex(
+                self._interface.get_recipe_stems())
+        return self._pantry_index
+
+    def _check_indexes(self):
+        """
+        Apply the recipes changed since the indexes were last checked to
+        them. If too many changed, or changes that old aren't logged, drop
+        them to be rebuilt. Orders are dropped on any recipe change.
+        """
+        # Read on a reader connection, so it doesn't wait for loading.
+        generation = self._interface.generation
+        if generation == self._indexed_generation:
+            return
+        indexes = [index for index in (self._recipe_index, self._pantry_index)
+                   if index is not None]
+        changed = None
+        if (indexes or self._order_positions) \
+                and self._indexed_generation is not None:
+            generation, changed = self._interface.get_recipe_changes(
+                self._indexed_generation)
+
+        if changed is None or len(changed) > INDEX_UPDATE_MAX_RECIPES:
+            self._recipe_index = None
+            self._pantry_index = None
+            self._order_positions = {}
+        elif changed:
+            recipe_stems = list(self._interface.get_recipe_stems(changed))
+            for index in indexes:
+                index.update(changed, recipe_stems)
+            self._order_positions = {}
+        self._indexed_generation = generation
 
     def get_ingredients(self) -> list[Ingredient]:
         """
         Return unordered list of all stored ingredients.
         """
-        return self._interface.get_ingredients()
+        return list(self._interface.get_ingredients())
 
     def get_recipe_id(self, title, url) -> int:
         return self._interface.get_recipe_id(title, url)
@@ -5,21 +5,27 @@ https://docs.python.org/3/library/unittest.html
 
 import unittest
 import os
+import threading
 
 import pytest
 
-from processing import Loader, IngrParser, Searcher
-from definitions import Ingredient, Recipe
+from processing import (
+    Loader, IngrCompleter, IngrIndex, IngrParser, PantryIndex, RecipeIndex,
+    Searcher)
+from definitions import Ingredient, Recipe, stem_cache_info
 from paths import project_path, ingredients_path
+import instrumentation
 
 INGREDIENTS_TEST_FILE = project_path + 'wtc/test_files/ingredients_test.txt'
 RECIPES_TEST_FILE = project_path + 'wtc/test_files/recipes_test.csv'
 
 @pytest.fixture
-def clean_setup(scope="function"):
-    import os
-    os.remove(project_path+'/wtc/recipes.db')
-    loader = Loader()
+def database(tmp_path) -> str:
+    return str(tmp_path / 'recipes.db')
+
+@pytest.fixture
+def clean_setup(database):
+    loader = Loader(database=database)
     loader.set_ingr_path(INGREDIENTS_TEST_FILE)
     loader.set_recipes_path(RECIPES_TEST_FILE)
     yield loader
@@ -99,6 +105,7 @@ class TestApp:
 
     def test_no_known_ingredients(self,
                                   clean_setup,
+                                  database,
                                   recipes_test_set):
         """
         Test recipe loading without any ingredients in the database.
@@ -112,7 +119,7 @@ class TestApp:
         pending_review = loader.get_pending_review()
         assert len(pending_review) == len(recipes_test_set)
 
-        searcher = Searcher()
+        searcher = Searcher(database=database)
         assert searcher.get_ingredients() == []
 
         assert not searcher.get_recipes()
@@ -128,7 +135,9 @@ class TestApp:
 
         loader.solve_unknown(
             id, '5 cucchiai di olio extravergine di oliva', Ingredient('olio'))
-        assert loader.num_pending_review == 29
+        # Solving olio also solves the olio line of the merluzzo recipe, as
+        # it did before the unknowns were indexed.
+        assert loader.num_pending_review == 28
 
         # TODO test common unkown solving feature
 
@@ -139,6 +148,7 @@ class TestApp:
 
     def test_no_unknown_ingredients(self,
                                     clean_setup,
+                                    database,
                                     recipes_test_set: list[Recipe],
                                     ingredients_test_set):
         """
@@ -155,7 +165,7 @@ class TestApp:
         pending_review = loader.get_pending_review()
         assert not pending_review
 
-        searcher = Searcher()
+        searcher = Searcher(database=database)
         ingredients = searcher.get_ingredients()
         assert len(ingredients) == len(ingredients_test_set)
         for ingredient in ingredients:
@@ -173,5 +183,515 @@ class TestApp:
             == searcher.get_recipes(['Asparago', 'burro'])
 
 
+class TestDatabase:
+
+    def test_in_memory(self, database, recipes_test_set):
+        from db import Interface
+
+        interface = Interface(database, in_memory=True)
+        for ingr in recipes_test_set[0].ingredients_known:
+            interface.store_ingredient(ingr)
+        interface.store_recipe(recipes_test_set[0])
+        assert Interface(database).get_recipes() == []
+        interface.close()
+        assert Interface(database).get_recipes() == recipes_test_set[:1]
+
+        shared = 'file:test_in_memory?mode=memory&cache=shared'
+        first = Interface(shared)
+        for ingr in recipes_test_set[1].ingredients_known:
+            first.store_ingredient(ingr)
+        first.store_recipe(recipes_test_set[1])
+        assert Interface(shared).get_recipes() == recipes_test_set[1:2]
+
+
+    def test_migrate_baseline_schema(self, database):
+        import sqlite3
+
+        from db import Interface, SCHEMA_VERSION
+
+        # Schema of databases created before versioning, view included.
+        con = sqlite3.connect(database)
+        con.executescript('''
+            CREATE TABLE recipes
+            (recipe_id integer primary key autoincrement,
+            title text unique, url text unique);
+            CREATE TABLE ingredients (name text primary key);
+            CREATE TABLE recipes_ingredients
+            (recipe_id integer, ingr_name text,
+            primary key (recipe_id, ingr_name),
+            foreign key (recipe_id) references recipes(recipe_id),
+            foreign key (ingr_name) references ingredients(name));
+            CREATE TABLE ingr_unknowns
+            (recipe_id integer, text_containing_ingr text,
+            foreign key (recipe_id) references recipes(recipe_id));
+            CREATE VIEW recipes_with_unknowns
+            AS
+                SELECT *
+                FROM
+                    (SELECT recipe_id, title, count(*) AS num_unkonwn_ingr
+                    FROM ingr_unkowns
+                    JOIN recipes using(recipe_id));
+            INSERT INTO ingredients VALUES ('carote');
+            INSERT INTO recipes VALUES (1, 'Hummus', 'http://hummus');
+            INSERT INTO recipes_ingredients VALUES (1, 'carote');
+            INSERT INTO ingr_unknowns VALUES (1, '2 cucchiai di tahina');
+        ''')
+        con.commit()
+        assert con.execute('PRAGMA user_version').fetchone() == (0,)
+        con.close()
+
+        Interface(database).close()
+
+        con = sqlite3.connect(database)
+        assert con.execute('PRAGMA user_version').fetchone() \
+            == (SCHEMA_VERSION,)
+        assert con.execute('SELECT * FROM recipes_with_unknowns').fetchall() \
+            == [(1, 'Hummus', 1)]
+        assert con.execute(
+            'SELECT ingr_stem FROM recipes_ingredients').fetchall() \
+            == [(Ingredient('carote').stem,)]
+        assert con.execute('SELECT ingr_stem FROM ingredients').fetchall() \
+            == [(Ingredient('carote').stem,)]
+        con.close()
+
+
+class TestLoader:
+
+    def test_store_ingredients_report(self, clean_setup, tmp_path):
+        loader = clean_setup
+        ingredients_file = tmp_path / 'ingredients.txt'
+        ingredients_file.write_text('carota\nCarote\nolio\n\nsale 2\n')
+        loader.set_ingr_path(str(ingredients_file))
+
+        assert loader.store_ingredients() == {
+            'added': ['carota', 'olio'],
+            'present': [],
+            'duplicated': ['carote'],
+            'invalid': ['sale 2'],
+        }
+
+        ingredients_file.write_text('carote\nolio\npepe\n')
+        report = loader.store_ingredients()
+        assert report['added'] == ['pepe']
+        assert report['present'] == ['carote', 'olio']
+
+
+def _loaded_state(loader: Loader) -> tuple:
+    return (loader._interface.get_recipes(),
+            list(loader._interface.get_unknowns()))
+
+
+class TestLoadWorkers:
+
+    def test_pool_matches_single_process(self, clean_setup, tmp_path):
+        # Without olio some recipes have unknowns.
+        ingredients_file = tmp_path / 'ingredients.txt'
+        with open(INGREDIENTS_TEST_FILE) as fp:
+            ingredients_file.write_text(
+                ''.join(line for line in fp if line.strip() != 'olio'))
+        loader = clean_setup
+        loader.set_ingr_path(str(ingredients_file))
+        loader.store_ingredients()
+        counters = loader.load_recipes(workers=1)
+
+        pooled = Loader(database=str(tmp_path / 'pooled.db'))
+        pooled.set_ingr_path(str(ingredients_file))
+        pooled.set_recipes_path(RECIPES_TEST_FILE)
+        pooled.store_ingredients()
+        assert pooled.load_recipes(workers=2, chunk_size=2) == counters
+        assert _loaded_state(pooled) == _loaded_state(loader)
+        assert list(loader._interface.get_unknowns())
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_cancel(self, clean_setup, tmp_path, workers):
+        loader = clean_setup
+        loader.store_ingredients()
+        cancel = threading.Event()
+        num_loaded, num_with_unknowns, _ = loader.load_recipes(
+            batch_size=2, workers=workers, chunk_size=1,
+            progress=lambda progress: cancel.set(), cancel=cancel)
+        assert num_loaded + num_with_unknowns <= 2
+
+        # The next load goes on from the recipes already stored.
+        loader.load_recipes(workers=workers)
+        full = Loader(database=str(tmp_path / 'full.db'))
+        full.set_ingr_path(INGREDIENTS_TEST_FILE)
+        full.set_recipes_path(RECIPES_TEST_FILE)
+        full.store_ingredients()
+        full.load_recipes()
+        assert _loaded_state(loader) == _loaded_state(full)
+
+
+@pytest.fixture
+def csv_setup(clean_setup, tmp_path):
+    """Loader with a few ingredients stored and an empty recipes file."""
+    loader = clean_setup
+    ingredients_file = tmp_path / 'ingredients.txt'
+    ingredients_file.write_text('carote\nolio\nsale\n')
+    loader.set_ingr_path(str(ingredients_file))
+    loader.store_ingredients()
+    recipes_file = tmp_path / 'recipes.csv'
+    recipes_file.write_text('')
+    loader.set_recipes_path(str(recipes_file))
+    return loader, recipes_file
+
+
+def _recipe(title: str, *names: str) -> Recipe:
+    return Recipe(title, f'http://{title.lower()}',
+                  tuple(Ingredient(name) for name in names))
+
+
+class TestIncrementalLoad:
+
+    def test_unchanged_file_skipped(self, csv_setup, monkeypatch):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote\n')
+        assert loader.load_recipes() == (1, 0, 0)
+
+        def read_recipe_line(*args):
+            raise AssertionError('file read again')
+        monkeypatch.setattr(loader, '_read_recipe_line', read_recipe_line)
+        assert loader.load_recipes() == (0, 0, 0)
+
+    def test_appended_file(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote\n')
+        loader.load_recipes()
+        with recipes_file.open('a') as fp:
+            fp.write('B,http://b,sale\n')
+
+        assert loader.load_recipes() == (1, 0, 0)
+        assert loader._interface.get_recipes() == [
+            _recipe('A', 'carote'), _recipe('B', 'sale')]
+
+    def test_append_without_trailing_newline(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote')
+        loader.load_recipes()
+        with recipes_file.open('a') as fp:
+            fp.write(',olio\nB,http://b,sale\n')
+
+        assert loader.load_recipes() == (2, 0, 0)
+        assert loader._interface.get_recipes() == [
+            _recipe('A', 'carote', 'olio'), _recipe('B', 'sale')]
+
+    def test_modified_row(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote\nB,http://b,sale\n')
+        loader.load_recipes()
+        recipes_file.write_text('A,http://a,carote,olio\nB,http://b,sale\n')
+
+        assert loader.load_recipes() == (1, 0, 0)
+        assert loader._interface.get_recipes() == [
+            _recipe('A', 'carote', 'olio'), _recipe('B', 'sale')]
+
+    def test_deleted_row(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote\nB,http://b,sale\n')
+        loader.load_recipes()
+        recipes_file.write_text('B,http://b,sale\n')
+
+        assert loader.load_recipes() == (0, 0, 0)
+        assert loader._interface.get_recipes() == [
+            _recipe('A', 'carote'), _recipe('B', 'sale')]
+
+        # With its row gone, a new row for A replaces it.
+        recipes_file.write_text('B,http://b,sale\nA,http://a,olio\n')
+        assert loader.load_recipes() == (1, 0, 0)
+        assert loader._interface.get_recipes() == [
+            _recipe('A', 'olio'), _recipe('B', 'sale')]
+
+    def test_unknown_index_follows_commits(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote,pepe\n')
+        loader.load_recipes()
+        pepe = Ingredient('pepe')
+        assert list(loader.get_solution_candidates(pepe)) == [1]
+
+        with recipes_file.open('a') as fp:
+            fp.write('B,http://b,sale,pepe nero\n')
+        loader.load_recipes()
+        assert list(loader.get_solution_candidates(pepe)) == [1, 2]
+
+        # Nothing solved is dropped from the index if it's rolled back.
+        with pytest.raises(RuntimeError):
+            with loader._interface.transaction():
+                loader.solve_unknown(1, 'pepe', pepe)
+                raise RuntimeError
+        assert list(loader.get_solution_candidates(pepe)) == [1, 2]
+
+        loader.solve_unknown(1, 'pepe', pepe)
+        assert loader.get_solution_candidates(pepe) == {}
+        assert list(loader._interface.get_unknowns()) == []
+
+    def test_duplicate_rows_kept_once(self, csv_setup):
+        loader, recipes_file = csv_setup
+        recipes_file.write_text('A,http://a,carote\nA,http://a,olio\n'
+                                ',http://c,sale\n')
+        assert loader.load_recipes() == (1, 0, 1)
+
+        for incremental in (False, True):
+            os.utime(recipes_file, ns=(0, 0))
+            assert loader.load_recipes(incremental=incremental)[0] == 0
+            assert loader._interface.get_recipes() == [
+                _recipe('A', 'carote')]
+
+
+class TestSearcher:
+
+    def test_result_cache(self, clean_setup, database, recipes_test_set):
+        loader = clean_setup
+        loader.store_ingredients()
+        loader.load_recipes()
+        searcher = Searcher(database=database)
+
+        def lookups():
+            info = searcher.cache_info()
+            return info['hits'], info['misses']
+
+        assert searcher.get_recipes(['carota']) == recipes_test_set[:1]
+        assert lookups() == (0, 1)
+        assert searcher.get_recipes(['Carote']) == recipes_test_set[:1]
+        assert lookups() == (1, 1)
+        recipe_id = searcher.get_recipe_id(recipes_test_set[0].title,
+                                           recipes_test_set[0].url)
+        assert searcher.search_recipe_ids(['carota']) == [recipe_id]
+        assert lookups() == (1, 2)
+        assert searcher.cache_info()['size'] == 2
+
+        loader.delete_recipe(recipe_id)
+        assert searcher.get_recipes(['carota']) == []
+        assert lookups() == (1, 3)
+        assert searcher.cache_info()['size'] == 1
+
+
+    def test_search_during_write(self, clean_setup, recipes_test_set):
+        loader = clean_setup
+        loader.store_ingredients()
+        loader.load_recipes()
+        interface = loader._interface
+        searcher = Searcher(interface)
+        recipe = recipes_test_set[0]
+
+        with interface.transaction():
+            interface.delete_recipe(
+                searcher.get_recipe_id(recipe.title, recipe.url))
+            # Runs on a reader while the transaction holds the writer.
+            search = interface.submit(searcher.get_recipes, ['carota'])
+            assert search.result(timeout=5) == [recipe]
+        assert searcher.get_recipes(['carota']) == []
+
+    def test_indexes_follow_changes(self, clean_setup, tmp_path,
+                                    recipes_test_set):
+        # Without olio some recipes have unknowns.
+        ingredients_file = tmp_path / 'ingredients.txt'
+        with open(INGREDIENTS_TEST_FILE) as fp:
+            ingredients_file.write_text(
+                ''.join(line for line in fp if line.strip() != 'olio'))
+        loader = clean_setup
+        loader.set_ingr_path(str(ingredients_file))
+        loader.store_ingredients()
+        loader.load_recipes()
+        interface = loader._interface
+        searcher = Searcher(interface)
+        recipe_index = searcher.recipe_index
+        pantry_index = searcher.pantry_index
+        num_indexed = len(recipe_index)
+
+        recipe_id, _, _, text = next(
+            unknown for unknown in interface.get_unknowns()
+            if 'olio' in unknown[3])
+        loader.solve_unknown(recipe_id, text, Ingredient('olio'))
+        assert len(searcher.recipe_index) == num_indexed + 2
+        recipe = recipes_test_set[1]
+        loader.delete_recipe(searcher.get_recipe_id(recipe.title, recipe.url))
+        interface.delete_unknown('nothing to delete')
+        interface.store_ingredient(Ingredient('pepe nero'))
+        assert searcher.recipe_index is recipe_index
+        assert searcher.pantry_index is pantry_index
+
+        rebuilt = Searcher(interface)
+        stems = [Ingredient('sale').stem]
+        assert recipe_index.search([]) == rebuilt.recipe_index.search([])
+        assert recipe_index.search(stems) \
+            == rebuilt.recipe_index.search(stems)
+        assert pantry_index.cookable(stems, max_missing=3) \
+            == rebuilt.pantry_index.cookable(stems, max_missing=3)
+
+    def test_result_pages(self, clean_setup, database, recipes_test_set):
+        loader = clean_setup
+        loader.store_ingredients()
+        loader.load_recipes()
+        searcher = Searcher(database=database)
+
+        results = searcher.get_results([], page_size=2)
+        assert len(results) == len(recipes_test_set)
+        assert results.num_pages == -(-len(recipes_test_set) // 2)
+        assert results.page(0) == recipes_test_set[:2]
+        assert list(results) == recipes_test_set
+
+        # Pages already fetched are kept, later ones skip deleted recipes.
+        results = searcher.get_results([], page_size=2)
+        first_page = results.page(0)
+        for recipe in recipes_test_set[:3]:
+            loader.delete_recipe(
+                searcher.get_recipe_id(recipe.title, recipe.url))
+        assert results.page(0) == first_page
+        assert results.page(1) == recipes_test_set[3:4]
+
+
+class TestInstrumentation:
+
+    def test_timers_only_when_enabled(self):
+        index = IngrIndex([Ingredient('olio')])
+        instrumentation.reset()
+        index.find('olio')
+        assert instrumentation.stats() == {}
+
+        instrumentation.enable()
+        try:
+            index.find('olio')
+            index.find('olio di oliva')
+            with instrumentation.timer('query', 'test'):
+                pass
+        finally:
+            instrumentation.enable(False)
+        stats = instrumentation.stats()
+        assert stats['extract_ingredient']['count'] == 2
+        assert stats['query.test']['count'] == 1
+
+    def test_only_writes_commit(self, database):
+        from db import Interface
+
+        interface = Interface(database)
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            interface.get_recipes()
+            interface.num_unknowns
+            assert 'commit' not in instrumentation.stats()
+            interface.store_ingredient(Ingredient('olio'))
+        finally:
+            instrumentation.enable(False)
+        assert instrumentation.stats()['commit']['count'] == 1
+
+
+class TestIngrIndex:
+
+    def test_longest_match_first(self):
+        index = IngrIndex([Ingredient('cipolla'),
+                           Ingredient('erba cipollina'),
+                           Ingredient('olio')])
+
+        assert index.find('qualche filo di erba cipollina') \
+            == Ingredient('erba cipollina')
+        assert index.find('2 cipolle bianche') == Ingredient('cipolla')
+        assert index.find("olio d'oliva, cipolle").name == 'olio'
+        with pytest.raises(ValueError):
+            index.find('1 pizzico di paprika')
+
+    def test_parser_accepts_plain_lists(self):
+        parser = IngrParser()
+        assert parser.extract_ingredient(
+            '500 g di carote', [Ingredient('carota')]) == Ingredient('carota')
+
+
+    def test_stems_are_cached(self):
+        Ingredient('pomodoro')
+        hits = stem_cache_info().hits
+        Ingredient('Pomodoro ')
+        assert stem_cache_info().hits == hits + 1
+
+
+class TestIngrCompleter:
+
+    def test_complete(self):
+        completer = IngrCompleter(['Olio', 'Erba cipollina', 'Cipolla'])
+
+        assert completer.complete('') == ['Cipolla', 'Erba cipollina', 'Olio']
+        assert completer.complete('CIP') == ['Cipolla', 'Erba cipollina']
+        assert completer.complete('cipolli') == ['Erba cipollina']
+        assert completer.complete('x') == []
+
+        completer.add('Cipolle rosse')
+        assert completer.complete('cipoll') \
+            == ['Cipolla', 'Cipolle rosse', 'Erba cipollina']
+        assert completer.complete('ros') == ['Cipolle rosse']
+
+
+INDEXED_RECIPES = [
+    (1, 'carot'), (1, 'oli'), (1, 'sal'),
+    (2, 'burr'), (2, 'sal'),
+    (3, None),
+    (4, 'oli'), (4, 'sal'),
+    (6, 'pep'),
+]
+
+
+class TestRecipeIndex:
+
+    @pytest.fixture
+    def index(self):
+        return RecipeIndex(INDEXED_RECIPES[:-1])
+
+    def test_search(self, index):
+        assert index.search([]) == [1, 2, 3, 4]
+        assert index.search(['sal']) == [1, 2, 4]
+        assert index.search(['oli', 'sal']) == [1, 4]
+        assert index.search(['oli', 'burr']) == []
+        assert index.search(['pep']) == []
+
+    def test_rank(self, index):
+        assert index.rank(['oli', 'sal']) \
+            == [(4, 1.0, 0), (1, 2 / 3, 1), (2, 0.5, 1)]
+        assert index.rank(['oli', 'sal'], limit=1) == [(4, 1.0, 0)]
+
+    @pytest.mark.parametrize('index_class', [RecipeIndex, PantryIndex])
+    def test_update_matches_rebuild(self, index_class):
+        index = index_class(INDEXED_RECIPES)
+        # 1 is deleted, 2 changes, 3 gets unknowns, 5 is added, 6 unchanged.
+        index.update([1, 2, 3, 5, 6],
+                     [(2, 'oli'), (5, 'burr'), (5, 'sal'), (6, 'pep')])
+        rebuilt = index_class([(2, 'oli'), (4, 'oli'), (4, 'sal'),
+                               (5, 'burr'), (5, 'sal'), (6, 'pep')])
+        assert len(index) == len(rebuilt) == 4
+
+        for stems in ([], ['sal'], ['oli'], ['burr', 'sal'], ['carot']):
+            if index_class is RecipeIndex:
+                assert index.search(stems) == rebuilt.search(stems)
+                assert index.rank(stems) == rebuilt.rank(stems)
+            else:
+                assert index.containing(stems) == rebuilt.containing(stems)
+                assert index.cookable(stems, max_missing=1) \
+                    == rebuilt.cookable(stems, max_missing=1)
+
+        # A removed recipe can come back.
+        index.update([1], [(1, 'sal')])
+        if index_class is RecipeIndex:
+            assert index.search(['sal']) == [1, 4, 5]
+        else:
+            assert index.cookable(['sal']) == [(1, 0)]
+
+
+class TestPantryIndex:
+
+    def test_cookable(self):
+        index = PantryIndex([
+            (1, 'carot'), (1, 'oli'), (1, 'sal'),
+            (2, 'burr'), (2, 'sal'),
+            (3, None),
+            (4, 'oli'), (4, 'sal'),
+        ])
+
+        assert index.cookable(['oli', 'sal', 'pep']) == [(3, 0), (4, 0)]
+        assert index.cookable(['oli', 'sal'], max_missing=1) \
+            == [(3, 0), (4, 0), (1, 1), (2, 1)]
+        assert index.cookable(['oli'], max_missing=2) \
+            == [(3, 0), (4, 1), (1, 2), (2, 2)]
+        assert index.cookable([], max_missing=1) == [(3, 0)]
+        assert index.containing(['sal', 'oli']) == [1, 4]
+        assert index.containing(['pep']) == []
+
+
 if __name__ == '__main__':
     pytest.main()